@@ -5,15 +5,21 @@ import pandas as pd
 import json
 import google.generativeai as genai
 from dotenv import load_dotenv
-from sqlalchemy import create_engine, text, inspect
+from sqlalchemy import text, inspect
 from langchain_community.utilities import SQLDatabase
 
-# Helper to normalize URI
-def get_db_uri(path_or_uri):
-    if "://" not in path_or_uri:
-        # Assume SQLite file path
-        return f"sqlite:///{path_or_uri}"
-    return path_or_uri
+try:
+    from .connections import get_engine, resolve_target
+    from .metrics import record_query_latency, record_llm_call
+    from .replicas import get_replica_set, connect_replica, requires_primary, replica_unreachable, rejected_as_read_only
+    from .slowlog import record_if_slow
+    from .approx import rewrite_approximate, finalize_approximate, is_empty_sample
+except ImportError:
+    from connections import get_engine, resolve_target
+    from metrics import record_query_latency, record_llm_call
+    from replicas import get_replica_set, connect_replica, requires_primary, replica_unreachable, rejected_as_read_only
+    from slowlog import record_if_slow
+    from approx import rewrite_approximate, finalize_approximate, is_empty_sample
 
 # Check backend/.env first, then root .env
 backend_env = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.env')
@@ -46,67 +52,152 @@ print(f"DEBUG: Initializing GenerativeModel with {MODEL_NAME}...")
 model = genai.GenerativeModel(MODEL_NAME)
 print("DEBUG: GenerativeModel Initialized.")
 
-def execute_sql_commands(sql_command: str, db_path: str):
+# Statement prefixes treated as read-only (results returned as tables)
+READ_ONLY_PREFIXES = ("SELECT", "PRAGMA", "SHOW", "DESCRIBE", "EXPLAIN", "WITH")
+
+def execute_sql_commands(sql_command: str, db_path: str, params: dict = None, approximate: float = None):
     """
     Executes SQL using SQLAlchemy to support multiple dialects (SQLite, Postgres).
+    Optional bind `params` are applied to read-only statements.
+    With `approximate` (a sample percentage), eligible aggregate SELECTs run
+    over a sample and return estimates with error bounds.
+    Read-only statements go to a read replica when the target has one, until
+    the first DML/DDL statement; after that reads stay on the primary so the
+    request sees its own writes.
     """
-    db_uri = get_db_uri(db_path)
-    engine = create_engine(db_uri)
+    replica_set = get_replica_set(db_path)
     datasets = []
     
     import sqlparse
+    import time
     statements = sqlparse.split(sql_command)
-    
+
+    # Connections are opened lazily: {'primary' | 'replica': (conn, replica_uri)}
+    connections = {}
+
+    def get_connection(read_only: bool, wrote: bool):
+        if read_only and not wrote and replica_set:
+            if "replica" not in connections:
+                connections["replica"] = connect_replica(db_path)
+            if connections["replica"][0] is not None:
+                return connections["replica"]
+        if "primary" not in connections:
+            # Shared pooled engine; sandbox URIs are routed onto the base pool.
+            # Resolved here so a known-down target surfaces as a dataset error.
+            connections["primary"] = (get_engine(db_path).connect(), None)
+        return connections["primary"]
+
+    def run_read(conn, stmt):
+        approx_plan = rewrite_approximate(stmt, conn.dialect.name, approximate) if approximate else None
+        started = time.perf_counter()
+        if approx_plan:
+            try:
+                df = pd.read_sql_query(text(approx_plan["sql"]), conn, params=params)
+                if not is_empty_sample(df.to_dict(orient='records')):
+                    return df, approx_plan["sql"], approx_plan, time.perf_counter() - started
+                # Nothing was sampled: answer exactly rather than report 0 ± 0
+            except Exception as e:
+                # The rewrite is best effort; the statement as written decides
+                print(f"DEBUG: Approximate query failed, running exactly: {e}")
+                conn.rollback()
+        df = pd.read_sql_query(text(stmt), conn, params=params)
+        return df, stmt, None, time.perf_counter() - started
+
+    wrote = False
     try:
-        with engine.connect() as conn:
-            for statement in statements:
-                stmt = statement.strip()
-                if not stmt:
-                    continue
-                    
-                upper_sql = stmt.upper()
+        for statement in statements:
+            stmt = statement.strip()
+            if not stmt:
+                continue
                 
-                # Check if it's a SELECT query (read-only)
-                if upper_sql.startswith(("SELECT", "PRAGMA", "SHOW", "DESCRIBE", "EXPLAIN", "WITH")):
+            upper_sql = stmt.upper()
+            
+            # Check if it's a SELECT query (read-only)
+            if upper_sql.startswith(READ_ONLY_PREFIXES):
+                # Row locks / writable CTEs run on the primary, as do later reads
+                writes = requires_primary(stmt)
+                wrote = wrote or writes
+                conn, replica_uri = get_connection(True, wrote)
+                try:
                     try:
-                        df = pd.read_sql_query(text(stmt), conn)
-                        datasets.append({
-                            "type": "table",
-                            "data": df.to_dict(orient='records'),
-                            "sql": stmt
-                        })
+                        df, run_sql, approx_plan, elapsed = run_read(conn, stmt)
                     except Exception as e:
-                         # Attempt to capture error
-                         datasets.append({
-                            "type": "error",
-                            "data": [{"error": str(e)}],
-                            "sql": stmt
-                        })
-                else:
-                    # Handle DDL/DML
-                    try:
-                        result = conn.execute(text(stmt))
+                        if not replica_uri:
+                            raise
+                        if replica_unreachable(e):
+                            replica_set.mark_down(replica_uri, e)
+                        elif rejected_as_read_only(e):
+                            # The statement writes after all
+                            writes = wrote = True
+                        else:
+                            raise
+                        print(f"WARNING: Replica {replica_uri.split('@')[-1]} failed, retrying on primary: {e}")
+                        connections["replica"][0].close()
+                        connections["replica"] = (None, None)
+                        conn, replica_uri = get_connection(True, wrote)
+                        df, run_sql, approx_plan, elapsed = run_read(conn, stmt)
+                    if writes:
                         conn.commit()
-                        datasets.append({
-                            "type": "message",
-                            "data": [{
-                                "message": "Statement executed successfully", 
-                                "rows_affected": result.rowcount
-                            }],
-                            "sql": stmt
-                        })
-                    except Exception as e:
-                        datasets.append({
-                            "type": "error",
-                            "data": [{"error": str(e)}],
-                            "sql": stmt
-                        })
+
+                    record_query_latency(db_path, elapsed)
+                    record_if_slow(run_sql, db_path, elapsed, len(df), params)
+                    if replica_uri:
+                        replica_set.observe(replica_uri, elapsed)
+                    dataset = {
+                        "type": "table",
+                        "data": df.to_dict(orient='records'),
+                        "sql": stmt
+                    }
+                    if approximate:
+                        # Flag every result so clients can tell estimates from exact answers
+                        dataset["approximate"] = approx_plan is not None
+                        if approx_plan:
+                            dataset["data"] = finalize_approximate(dataset["data"], approx_plan)
+                            dataset["sample_percent"] = approx_plan["percent"]
+                            dataset["error_columns"] = [f"{a['name']}_error" for a in approx_plan["aggregates"]]
+                    datasets.append(dataset)
+                except Exception as e:
+                     # Attempt to capture error
+                     datasets.append({
+                        "type": "error",
+                        "data": [{"error": str(e)}],
+                        "sql": stmt
+                    })
+            else:
+                # Handle DDL/DML
+                conn, _ = get_connection(False, wrote)
+                wrote = True
+                try:
+                    started = time.perf_counter()
+                    result = conn.execute(text(stmt))
+                    conn.commit()
+                    elapsed = time.perf_counter() - started
+                    record_query_latency(db_path, elapsed)
+                    record_if_slow(stmt, db_path, elapsed, result.rowcount)
+                    datasets.append({
+                        "type": "message",
+                        "data": [{
+                            "message": "Statement executed successfully", 
+                            "rows_affected": result.rowcount
+                        }],
+                        "sql": stmt
+                    })
+                except Exception as e:
+                    datasets.append({
+                        "type": "error",
+                        "data": [{"error": str(e)}],
+                        "sql": stmt
+                    })
     except Exception as e:
         datasets.append({
              "type": "error",
              "data": [{"error": f"Connection/Engine Error: {str(e)}"}],
              "sql": "Global"
         })
+    finally:
+        for conn, _ in connections.values():
+            if conn is not None:
+                conn.close()
         
     return datasets
 
@@ -130,10 +221,9 @@ def get_schema_with_samples(db_path):
             return entry['schema']
     
     print(f"DEBUG: Cache miss/expired. Fetching schema for {db_path}...")
-    db_uri = get_db_uri(db_path)
-    
     try:
-        db = SQLDatabase.from_uri(db_uri)
+        engine, schema = resolve_target(db_path)
+        db = SQLDatabase(engine, schema=schema)
         table_names = db.get_usable_table_names()
         
         schema_str = ""
@@ -166,7 +256,7 @@ def get_schema_with_samples(db_path):
     except Exception as e:
         return f"Error fetching schema: {str(e)}"
 
-def run_sql_agent(user_query: str, db_path: str, history: list = [], safe_mode: bool = False):
+def run_sql_agent(user_query: str, db_path: str, history: list = [], safe_mode: bool = False, approximate: float = None):
     """
     Professional SQL Agent using Google Gemini (Direct SDK).
     """
@@ -245,10 +335,15 @@ Your goal is to help the user manage their database and understand their data.
                 response_mime_type="application/json"  # Enforce JSON if supported by model
             )
 
-            response = model.generate_content(
-                current_prompt,
-                generation_config=generation_config
-            )
+            try:
+                response = model.generate_content(
+                    current_prompt,
+                    generation_config=generation_config
+                )
+                record_llm_call(True)
+            except Exception as e:
+                record_llm_call(False, str(e))
+                raise
             
             print(f"DEBUG: SDK Response received.")
             
@@ -299,7 +394,7 @@ Your goal is to help the user manage their database and understand their data.
             ai_chart_type = ai_data.get('chart_type', 'table')
             
             # Execute SQL
-            datasets = execute_sql_commands(ai_sql, db_path)
+            datasets = execute_sql_commands(ai_sql, db_path, approximate=approximate)
             
             # Check execution errors
             is_error = False
@@ -331,6 +426,8 @@ Your goal is to help the user manage their database and understand their data.
                 if datasets:
                      final_response['data'] = datasets[-1].get('data')
                      final_response['chart_type'] = 'table' if datasets[-1].get('type') == 'table' else 'message'
+                if approximate:
+                    final_response['approximate'] = any(d.get('approximate') for d in datasets)
             
             return final_response
 
@@ -0,0 +1,207 @@
+import os
+import re
+import math
+
+# Default sample size for approximate mode, and the intermediate sample sizes
+# used when refining progressively towards the exact answer.
+APPROX_SAMPLE_PERCENT = float(os.getenv("APPROX_SAMPLE_PERCENT", "1"))
+APPROX_REFINE_PERCENTS = [float(p) for p in os.getenv("APPROX_REFINE_PERCENTS", "1,10").split(",") if p.strip()]
+Z_95 = 1.96
+
+_SIMPLE_SELECT = re.compile(
+    r"^SELECT\s+(?P<cols>.+?)\s+FROM\s+(?P<table>[A-Za-z_][\w.]*)"
+    r"(?:\s+(?:AS\s+)?(?P<alias>[A-Za-z_]\w*))?"
+    r"(?P<rest>\s+(?:WHERE|GROUP\s+BY|ORDER\s+BY|LIMIT)\b.*)?$",
+    re.I | re.S,
+)
+_AGGREGATE = re.compile(r"^(COUNT|SUM|AVG)\s*\(", re.I)
+_ALIASED = re.compile(r"^(.+?)\s+AS\s+([A-Za-z_]\w*)$", re.I | re.S)
+_BARE_ALIASED = re.compile(r"^(.+\))\s+([A-Za-z_]\w*)$", re.S)  # "SUM(x) total"
+_ANY_AGGREGATE = re.compile(r"\b(COUNT|SUM|AVG|MIN|MAX|STDDEV\w*|VAR\w*|ARRAY_AGG|STRING_AGG|GROUP_CONCAT)\s*\(", re.I)
+# Constructs whose results can't be scaled from a sample
+_INELIGIBLE = re.compile(r"\b(JOIN|UNION|INTERSECT|EXCEPT|HAVING|DISTINCT|OVER|TABLESAMPLE)\b|\bSELECT\b.*\bSELECT\b", re.I | re.S)
+_KEYWORDS = {"where", "group", "order", "limit", "join", "inner", "left", "right", "full", "cross", "natural", "on"}
+
+def _split_top_level(cols):
+    items, depth, current = [], 0, ""
+    for ch in cols:
+        if ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+        if ch == "," and depth == 0:
+            items.append(current.strip())
+            current = ""
+        else:
+            current += ch
+    items.append(current.strip())
+    return items
+
+def _aggregate_call(expr):
+    """
+    Returns (func, arg) when `expr` is a single COUNT/SUM/AVG call and
+    nothing else, otherwise None. The call has to span the whole expression,
+    so e.g. "SUM(x) FILTER (WHERE ...)" or "AVG(x)::numeric(10,2)" don't match.
+    """
+    match = _AGGREGATE.match(expr)
+    if not match:
+        return None
+    depth, quote = 1, None
+    for pos in range(match.end(), len(expr)):
+        ch = expr[pos]
+        if quote:
+            if ch == quote:
+                quote = None
+        elif ch in "'\"`":
+            quote = ch
+        elif ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+            if depth == 0:
+                arg = expr[match.end():pos].strip()
+                if pos != len(expr) - 1 or not arg:
+                    return None
+                return match.group(1).upper(), arg
+    return None
+
+def _exact_label(item, func, dialect):
+    """
+    Column name the database gives an unaliased aggregate: Postgres names it
+    after the function, SQLite and MySQL use the expression as written.
+    """
+    return func.lower() if dialect == "postgresql" else item
+
+def _quote_alias(name, dialect):
+    q = "`" if dialect == "mysql" else '"'
+    return q + name.replace(q, q + q) + q
+
+def _sampled_from(table, alias, dialect, percent):
+    name = alias or table.split(".")[-1]
+    fraction = percent / 100
+    if dialect == "postgresql":
+        # Block sampling: reads ~percent of the table's pages
+        return f"{table} AS {name} TABLESAMPLE SYSTEM ({percent:g})"
+    if dialect == "sqlite":
+        threshold = int(fraction * 1_000_000)
+        return f"(SELECT * FROM {table} WHERE (abs(random()) % 1000000) < {threshold}) AS {name}"
+    if dialect == "mysql":
+        return f"(SELECT * FROM {table} WHERE RAND() < {fraction:g}) AS {name}"
+    return None
+
+def _as_double(expr, dialect):
+    return f"CAST(({expr}) AS {'DOUBLE' if dialect == 'mysql' else 'DOUBLE PRECISION'})"
+
+def rewrite_approximate(stmt: str, dialect: str, percent: float):
+    """
+    Rewrites a single-table aggregate SELECT (COUNT/SUM/AVG, optional WHERE,
+    GROUP BY, ORDER BY, LIMIT) to run over a random sample of `percent`%
+    of the table. Returns None if the statement isn't eligible, in which case
+    it should run exactly.
+
+    Extra `__approx_*` columns are selected so finalize_approximate can scale
+    the results and compute 95% error bounds.
+    """
+    if not percent or percent >= 100:
+        return None
+    sql = stmt.strip().rstrip(";").strip()
+    if _INELIGIBLE.search(sql):
+        return None
+    match = _SIMPLE_SELECT.match(sql)
+    if not match or (match.group("alias") or "").lower() in _KEYWORDS:
+        return None
+
+    aggregates = []
+    select_items = []
+    used_names = set()
+    for i, item in enumerate(_split_top_level(match.group("cols"))):
+        aliased = _ALIASED.match(item) or _BARE_ALIASED.match(item)
+        expr, name = (aliased.group(1).strip(), aliased.group(2)) if aliased else (item, None)
+        agg = _aggregate_call(expr)
+        if not agg:
+            if _ANY_AGGREGATE.search(expr) or expr == "*":
+                # MIN/MAX, expressions over aggregates etc. can't be estimated
+                return None
+            select_items.append(item)
+            continue
+
+        func, arg = agg
+        if _ANY_AGGREGATE.search(arg):
+            return None
+        if not name:
+            # Keep the label the exact statement returns, so estimates and
+            # the exact answer share column names
+            name = _exact_label(item, func, dialect)
+            if name in used_names:
+                name = f"{name}_{i}"
+        used_names.add(name)
+        aggregates.append({"func": func, "arg": arg, "name": name, "index": i})
+        select_items.append(f"{func}({arg}) AS {_quote_alias(name, dialect)}")
+
+        # Squares are computed in floating point: in the column's own type
+        # (e.g. Postgres integer) they overflow long before the plain SUM does
+        if func == "SUM":
+            squared = _as_double(arg, dialect)
+            select_items.append(f"SUM({squared} * {squared}) AS __approx_sq_{i}")
+        elif func == "AVG":
+            squared = _as_double(arg, dialect)
+            select_items.append(f"COUNT({arg}) AS __approx_n_{i}")
+            select_items.append(f"AVG({squared} * {squared}) AS __approx_sq_{i}")
+
+    if not aggregates:
+        return None
+    select_items.append("COUNT(*) AS __approx_rows")
+
+    sampled = _sampled_from(match.group("table"), match.group("alias"), dialect, percent)
+    if sampled is None:
+        return None
+
+    rewritten = f"SELECT {', '.join(select_items)} FROM {sampled}{match.group('rest') or ''}"
+    return {"sql": rewritten, "percent": percent, "aggregates": aggregates}
+
+def finalize_approximate(records: list, plan: dict):
+    """
+    Scales sampled COUNT/SUM values up to the full table and adds a
+    `<column>_error` (95% half-width) for every estimated column.
+    """
+    fraction = plan["percent"] / 100
+    fpc = 1 - fraction  # finite population correction
+    results = []
+    for row in records:
+        out = {k: v for k, v in row.items() if not k.startswith("__approx_")}
+        for agg in plan["aggregates"]:
+            name, i = agg["name"], agg["index"]
+            value = row.get(name)
+            if value is None or (isinstance(value, float) and math.isnan(value)):
+                out[f"{name}_error"] = None
+                continue
+
+            # Nothing matched in the sample: the estimate is 0 but the bound is unknown
+            if agg["func"] == "COUNT":
+                out[name] = value / fraction
+                out[f"{name}_error"] = Z_95 * math.sqrt(value * fpc) / fraction if value else None
+            elif agg["func"] == "SUM":
+                sq = row.get(f"__approx_sq_{i}") or 0
+                out[name] = value / fraction
+                out[f"{name}_error"] = Z_95 * math.sqrt(max(sq, 0) * fpc) / fraction if sq else None
+            else:  # AVG
+                n = row.get(f"__approx_n_{i}") or 0
+                sq = row.get(f"__approx_sq_{i}") or 0
+                variance = max(sq - value * value, 0)
+                out[f"{name}_error"] = Z_95 * math.sqrt(variance / n * fpc) if n else None
+        results.append(out)
+    return results
+
+def is_empty_sample(records: list) -> bool:
+    """
+    True when the sample contained no rows at all (common for block sampling
+    of small tables); such results should be computed exactly instead.
+    """
+    return not records or all(not row.get("__approx_rows") for row in records)
+
+def refine_percents(start_percent: float):
+    """
+    Sample sizes for progressive refinement, ending with 100 (exact).
+    """
+    steps = [float(start_percent)] + [p for p in APPROX_REFINE_PERCENTS if p > start_percent]
+    return sorted(set(p for p in steps if 0 < p < 100)) + [100.0]
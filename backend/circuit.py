@@ -0,0 +1,115 @@
+import os
+import time
+import threading
+
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "3"))
+CIRCUIT_RESET_SECONDS = float(os.getenv("CIRCUIT_RESET_SECONDS", "30"))
+# How long a half-open probe may take before another request may probe instead
+CIRCUIT_PROBE_TIMEOUT = float(os.getenv("CIRCUIT_PROBE_TIMEOUT", "15"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+class CircuitOpenError(Exception):
+    pass
+
+class CircuitBreaker:
+    """
+    Per-target breaker around driver connects.
+
+    After CIRCUIT_FAILURE_THRESHOLD consecutive connect failures the circuit
+    opens and requests fail immediately with the last error. Once
+    CIRCUIT_RESET_SECONDS have passed, a single request is let through as a
+    probe. If the probe succeeds the circuit closes; if it fails the circuit
+    opens again.
+    """
+    def __init__(self, name, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_seconds=CIRCUIT_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_started_at = 0.0
+        self.last_error = None
+        self._lock = threading.Lock()
+
+    def before_request(self):
+        """
+        Raises CircuitOpenError if requests to this target should fail fast.
+        """
+        if self.state == CLOSED:
+            return
+
+        now = time.time()
+        with self._lock:
+            if self.state == OPEN and now - self.opened_at >= self.reset_seconds:
+                self.state = HALF_OPEN
+                self.probe_started_at = now
+                return
+            if self.state == HALF_OPEN and now - self.probe_started_at >= CIRCUIT_PROBE_TIMEOUT:
+                # Previous probe never reported back; let this request probe
+                self.probe_started_at = now
+                return
+            if self.state == CLOSED:
+                return
+            retry_in = max(0, int(self.reset_seconds - (now - self.opened_at)))
+
+        raise CircuitOpenError(
+            f"Database {self.name} is unavailable (circuit open, retry in {retry_in}s). "
+            f"Last error: {self.last_error}"
+        )
+
+    def raise_if_open(self):
+        """
+        Like before_request, but never claims the half-open probe. For callers
+        that want to bail out early without connecting themselves.
+        """
+        if self.state == OPEN and time.time() - self.opened_at < self.reset_seconds:
+            retry_in = max(0, int(self.reset_seconds - (time.time() - self.opened_at)))
+            raise CircuitOpenError(
+                f"Database {self.name} is unavailable (circuit open, retry in {retry_in}s). "
+                f"Last error: {self.last_error}"
+            )
+
+    def record_success(self):
+        if self.state == CLOSED and self.failures == 0:
+            return
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self.last_error = None
+
+    def record_failure(self, error):
+        with self._lock:
+            self.failures += 1
+            self.last_error = str(error).strip().splitlines()[0] if str(error).strip() else type(error).__name__
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    print(f"WARNING: Circuit opened for {self.name}: {self.last_error}")
+                self.state = OPEN
+                self.opened_at = time.time()
+
+    def status(self):
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "last_error": self.last_error,
+            "opened_at": self.opened_at if self.state != CLOSED else None,
+        }
+
+# {base_uri: CircuitBreaker}
+_BREAKERS = {}
+_BREAKERS_LOCK = threading.Lock()
+
+def get_breaker(base_uri: str, name: str = None):
+    breaker = _BREAKERS.get(base_uri)
+    if breaker is None:
+        with _BREAKERS_LOCK:
+            breaker = _BREAKERS.setdefault(base_uri, CircuitBreaker(name or base_uri))
+    return breaker
+
+def drop_breaker(base_uri: str):
+    with _BREAKERS_LOCK:
+        _BREAKERS.pop(base_uri, None)
@@ -0,0 +1,251 @@
+import os
+import threading
+from collections import OrderedDict
+from urllib.parse import urlsplit, urlunsplit, unquote
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+
+try:
+    from .circuit import get_breaker, drop_breaker, CircuitOpenError
+except ImportError:
+    from circuit import get_breaker, drop_breaker, CircuitOpenError
+
+# Pool sizing for every engine we create. All per-user sandboxes share the
+# engine of the base DATABASE_URL, so these numbers bound the total number of
+# server connections regardless of how many users exist.
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+# Seconds to wait for a driver connect before giving up (Postgres/MySQL)
+CONNECT_TIMEOUT = int(os.getenv("DB_CONNECT_TIMEOUT", "5"))
+# User-supplied connection URIs get small pools, and only the most recently
+# used DB_MAX_ENGINES of them are kept; older ones are disposed.
+EXTERNAL_POOL_SIZE = int(os.getenv("DB_EXTERNAL_POOL_SIZE", "1"))
+EXTERNAL_MAX_OVERFLOW = int(os.getenv("DB_EXTERNAL_MAX_OVERFLOW", "4"))
+MAX_ENGINES = int(os.getenv("DB_MAX_ENGINES", "16"))
+
+# {base_uri: Engine}, least recently used first
+_ENGINES = OrderedDict()
+# Base URIs that are never evicted (DATABASE_URL and its replicas)
+_PINNED = set()
+_ENGINES_LOCK = threading.Lock()
+
+def get_db_uri(path_or_uri):
+    if "://" not in path_or_uri:
+        # Assume SQLite file path
+        return f"sqlite:///{path_or_uri}"
+    return path_or_uri
+
+def _pop_query_param(db_uri: str, key: str, match=None):
+    """
+    Removes a query parameter from a URI (only the occurrence whose decoded
+    value satisfies `match`, if given). Other parameters are kept verbatim so
+    the remaining URI is byte-for-byte the original. Returns (uri, value or None).
+    """
+    if f"{key}=" not in db_uri:
+        return db_uri, None
+
+    parts = urlsplit(db_uri)
+    value = None
+    kept = []
+    for raw in parts.query.split("&"):
+        k, _, v = raw.partition("=")
+        decoded = unquote(v.replace("+", " "))
+        if value is None and unquote(k) == key and (match is None or match(decoded)):
+            value = decoded
+        else:
+            kept.append(raw)
+    if value is None:
+        return db_uri, None
+    return urlunsplit(parts._replace(query="&".join(kept))), value
+
+def split_tenant_uri(db_uri: str):
+    """
+    Splits a sandbox URI (as built by main.get_user_db_path) into the base URI
+    and the tenant schema encoded in `options=-csearch_path=<schema>`.
+    Any other `options` parameter (e.g. one already on DATABASE_URL) stays on
+    the base URI, so sandboxes resolve to exactly the DATABASE_URL engine.
+    Returns (base_uri, schema); schema is None for non-sandbox URIs.
+    """
+    stripped, options = _pop_query_param(
+        db_uri, "options", match=lambda v: v.startswith("-csearch_path=")
+    )
+    if options is None:
+        return db_uri, None
+    return stripped, options[len("-csearch_path="):]
+
+def split_replica_uri(db_uri: str):
+    """
+    Strips read-replica settings from a connection URI:
+    `replica_hosts=host1:5432,host2` (same credentials/database as the primary)
+    and `replica_strategy=round_robin|least_latency`.
+    Returns (uri, [hosts], strategy or None).
+    """
+    db_uri, hosts = _pop_query_param(db_uri, "replica_hosts")
+    db_uri, strategy = _pop_query_param(db_uri, "replica_strategy")
+    hosts = [h.strip() for h in (hosts or "").split(",") if h.strip()]
+    return db_uri, hosts, strategy
+
+def quote_schema(schema: str) -> str:
+    return '"' + schema.replace('"', '""') + '"'
+
+def _install_tenant_hooks(engine):
+    """
+    Scopes the tenant's search_path to each transaction on a shared pool.
+
+    `SET LOCAL` disappears on COMMIT/ROLLBACK, so a pooled connection can never
+    carry one user's schema into another user's checkout. As a second guard,
+    connections that served a tenant get their search_path reset on checkin in
+    case a library (e.g. LangChain's SQLDatabase) issued a session-level SET.
+    """
+    @event.listens_for(engine, "begin")
+    def _set_tenant_search_path(conn):
+        schema = conn.get_execution_options().get("tenant_schema")
+        if schema:
+            conn.exec_driver_sql(f"SET LOCAL search_path TO {quote_schema(schema)}")
+            conn.connection.info["tenant_schema"] = schema
+
+    @event.listens_for(engine.pool, "checkin")
+    def _reset_tenant_search_path(dbapi_connection, connection_record):
+        if dbapi_connection is None:
+            return
+        if connection_record.info.pop("tenant_schema", None) is None:
+            return
+        try:
+            cursor = dbapi_connection.cursor()
+            cursor.execute("RESET search_path")
+            cursor.close()
+            dbapi_connection.commit()
+        except Exception as e:
+            # Never hand out a connection in an unknown state
+            print(f"WARNING: Failed to reset search_path, invalidating connection: {e}")
+            connection_record.invalidate(e)
+
+def _install_circuit_hooks(engine, breaker):
+    """
+    Feeds driver connect outcomes into the target's circuit breaker.
+    """
+    @event.listens_for(engine, "do_connect")
+    def _guarded_connect(dialect, conn_rec, cargs, cparams):
+        # Only real connects claim the half-open probe
+        breaker.before_request()
+        try:
+            dbapi_connection = dialect.connect(*cargs, **cparams)
+        except Exception as e:
+            breaker.record_failure(e)
+            raise
+        breaker.record_success()
+        return dbapi_connection
+
+    @event.listens_for(engine.pool, "checkout")
+    def _pooled_checkout_ok(dbapi_connection, connection_record, connection_proxy):
+        # Reached after a successful pre-ping, so the target is reachable
+        breaker.record_success()
+
+# Name of the connect timeout argument per (backend, driver); other drivers
+# get none rather than an argument they'd reject
+_CONNECT_TIMEOUT_ARGS = {
+    ("postgresql", "psycopg2"): "connect_timeout",
+    ("postgresql", "psycopg"): "connect_timeout",
+    ("postgresql", "pg8000"): "timeout",
+    ("mysql", "pymysql"): "connect_timeout",
+    ("mysql", "mysqldb"): "connect_timeout",
+    ("mysql", "mysqlconnector"): "connection_timeout",
+    ("mariadb", "pymysql"): "connect_timeout",
+    ("mariadb", "mysqldb"): "connect_timeout",
+}
+
+def _connect_timeout_arg(base_uri: str):
+    url = make_url(base_uri)
+    backend = url.get_backend_name()
+    if backend not in ("postgresql", "mysql", "mariadb"):
+        return None
+    # "postgresql://" and "mysql://" use the dialect's default driver
+    driver = url.drivername.split("+", 1)[1] if "+" in url.drivername else None
+    driver = driver or {"postgresql": "psycopg2", "mysql": "mysqldb", "mariadb": "mysqldb"}[backend]
+    return _CONNECT_TIMEOUT_ARGS.get((backend, driver))
+
+def _create_engine(base_uri: str, pinned: bool = False):
+    kwargs = {"pool_pre_ping": True}
+    if not base_uri.startswith("sqlite"):
+        if pinned:
+            kwargs.update(pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW)
+        else:
+            kwargs.update(pool_size=EXTERNAL_POOL_SIZE, max_overflow=EXTERNAL_MAX_OVERFLOW)
+        kwargs["pool_recycle"] = POOL_RECYCLE
+        # A timeout given on the URI takes precedence
+        timeout_arg = _connect_timeout_arg(base_uri)
+        if timeout_arg and timeout_arg not in make_url(base_uri).query:
+            kwargs["connect_args"] = {timeout_arg: CONNECT_TIMEOUT}
+
+    engine = create_engine(base_uri, **kwargs)
+    if engine.dialect.name == "postgresql":
+        _install_tenant_hooks(engine)
+    _install_circuit_hooks(engine, get_breaker(base_uri, mask_uri(base_uri)))
+    return engine
+
+def mask_uri(db_uri: str) -> str:
+    return db_uri.split("@")[-1] if "@" in db_uri else db_uri
+
+def get_base_engine(base_uri: str, pinned: bool = False):
+    """
+    Returns the process-wide engine (and therefore pool) for a base URI.
+    Raises CircuitOpenError straight away if the target is known to be down
+    (without claiming the half-open probe; that happens on connect).
+
+    Pinned engines (the app's own databases) are kept for the life of the
+    process. Other engines are evicted least-recently-used beyond
+    MAX_ENGINES and their pools disposed.
+    """
+    get_breaker(base_uri, mask_uri(base_uri)).raise_if_open()
+
+    evicted = []
+    with _ENGINES_LOCK:
+        if pinned:
+            _PINNED.add(base_uri)
+        engine = _ENGINES.get(base_uri)
+        if engine is not None:
+            _ENGINES.move_to_end(base_uri)
+            return engine
+
+        engine = _create_engine(base_uri, pinned=base_uri in _PINNED)
+        _ENGINES[base_uri] = engine
+        unpinned = [uri for uri in _ENGINES if uri not in _PINNED]
+        for uri in unpinned[:max(len(unpinned) - MAX_ENGINES, 0)]:
+            evicted.append((uri, _ENGINES.pop(uri)))
+
+    for uri, old_engine in evicted:
+        # Idle connections are closed now; checked-out ones close when returned
+        print(f"DEBUG: Disposing idle engine for {mask_uri(uri)}")
+        old_engine.dispose()
+        drop_breaker(uri)
+    return engine
+
+def resolve_target(db_path: str):
+    """
+    Resolves a db path/URI to (engine, schema).
+    Sandbox URIs share the pool of their base URI; the returned engine is a
+    lightweight view of it that applies the tenant schema per transaction.
+    """
+    db_uri = split_replica_uri(get_db_uri(db_path))[0]
+    base_uri, schema = split_tenant_uri(db_uri)
+    engine = get_base_engine(base_uri)
+    if schema and engine.dialect.name == "postgresql":
+        return engine.execution_options(tenant_schema=schema), schema
+    return engine, None
+
+def get_engine(db_path: str):
+    return resolve_target(db_path)[0]
+
+def peek_engine(db_path: str):
+    """
+    Returns the existing base engine for a target without creating one or
+    consulting its circuit breaker, or None. For status reporting.
+    """
+    db_uri = split_replica_uri(get_db_uri(db_path))[0]
+    return _ENGINES.get(split_tenant_uri(db_uri)[0])
+
+def get_target_breaker(db_path: str):
+    db_uri = split_replica_uri(get_db_uri(db_path))[0]
+    base_uri = split_tenant_uri(db_uri)[0]
+    return get_breaker(base_uri, mask_uri(base_uri))
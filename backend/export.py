@@ -0,0 +1,259 @@
+import io
+import os
+import csv
+import json
+import zlib
+import sqlparse
+from sqlalchemy import text
+
+try:
+    from .agent import READ_ONLY_PREFIXES
+    from .connections import get_engine
+    from .replicas import connect_replica, requires_primary
+except ImportError:
+    from agent import READ_ONLY_PREFIXES
+    from connections import get_engine
+    from replicas import connect_replica, requires_primary
+
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "10000"))
+
+FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+COMPRESSIONS = {
+    "none": (None, ""),
+    "gzip": ("application/gzip", ".gz"),
+    "zstd": ("application/zstd", ".zst"),
+}
+
+class ExportError(Exception):
+    pass
+
+class _ChunkSink:
+    """
+    Write-only file object that hands back whatever was written since the last
+    drain, so ParquetWriter output can be streamed row group by row group.
+    """
+    def __init__(self):
+        self._parts = []
+        self._pos = 0
+        self.closed = False
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._pos
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b"".join(self._parts)
+        self._parts = []
+        return data
+
+def _compressor(compression):
+    if compression == "gzip":
+        return zlib.compressobj(wbits=31)  # gzip container
+    if compression == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise ExportError("zstd compression requires the 'zstandard' package")
+        return zstandard.ZstdCompressor().compressobj()
+    return None
+
+def _csv_chunks(columns, partitions):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(columns)
+    for rows in partitions:
+        writer.writerows(rows)
+        yield buf.getvalue().encode("utf-8")
+        buf.seek(0)
+        buf.truncate(0)
+
+def _ndjson_chunks(columns, partitions):
+    for rows in partitions:
+        lines = [json.dumps(dict(zip(columns, row)), default=str) for row in rows]
+        yield ("\n".join(lines) + "\n").encode("utf-8")
+
+def _description_type(type_code, dbapi):
+    """
+    Arrow type for a column from its DB-API type code (PEP 249 type objects),
+    or None when the driver doesn't report one (e.g. sqlite3).
+    """
+    import pyarrow as pa
+
+    if type_code is None or dbapi is None:
+        return None
+    for name, arrow_type in (("NUMBER", pa.float64()), ("DATETIME", pa.timestamp("us")),
+                             ("BINARY", pa.binary()), ("STRING", pa.string())):
+        type_object = getattr(dbapi, name, None)
+        try:
+            if type_object is not None and type_code == type_object:
+                return arrow_type
+        except Exception:
+            continue
+    return None
+
+def _parquet_schema(columns, rows, description, dbapi):
+    """
+    Fixes the file schema from the first batch. Columns that are all NULL in
+    that batch take their type from the cursor description (string if unknown),
+    and decimals are widened to full precision so later batches still fit.
+    """
+    import pyarrow as pa
+
+    fields = []
+    for i, col in enumerate(columns):
+        arrow_type = pa.array([row[i] for row in rows]).type
+        if pa.types.is_null(arrow_type):
+            type_code = description[i][1] if description and i < len(description) else None
+            arrow_type = _description_type(type_code, dbapi) or pa.string()
+        elif pa.types.is_decimal(arrow_type):
+            arrow_type = pa.decimal128(38, arrow_type.scale)
+        fields.append(pa.field(col, arrow_type))
+    return pa.schema(fields)
+
+def _coerce(value, arrow_type):
+    import pyarrow as pa
+
+    if value is None:
+        return None
+    if pa.types.is_string(arrow_type):
+        return value if isinstance(value, str) else str(value)
+    if pa.types.is_floating(arrow_type):
+        return float(value)
+    if pa.types.is_integer(arrow_type) and float(value) == int(value):
+        return int(value)
+    return value
+
+def _parquet_table(columns, rows, schema):
+    import pyarrow as pa
+
+    arrays = []
+    for i, field in enumerate(schema):
+        values = [row[i] for row in rows]
+        if pa.types.is_integer(field.type) and any(isinstance(v, float) and not v.is_integer() for v in values):
+            # pyarrow would silently truncate these
+            raise ExportError(f"Column {field.name} has fractional values but was exported as {field.type}")
+        try:
+            arrays.append(pa.array(values, type=field.type))
+        except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError, ValueError):
+            # Same column, different Python type in a later batch (e.g. NULLs
+            # then ints, or ints then floats in SQLite): coerce to the file's type
+            try:
+                arrays.append(pa.array([_coerce(v, field.type) for v in values], type=field.type))
+            except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError, ValueError) as e:
+                raise ExportError(f"Column {field.name} does not fit Parquet type {field.type}: {e}")
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+def _parquet_chunks(columns, partitions, compression, description=None, dbapi=None):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    sink = _ChunkSink()
+    writer = None
+    schema = None
+    codec = compression if compression in ("gzip", "zstd") else "none"
+
+    for rows in partitions:
+        if schema is None:
+            schema = _parquet_schema(columns, rows, description, dbapi)
+            writer = pq.ParquetWriter(sink, schema, compression=codec)
+        writer.write_table(_parquet_table(columns, rows, schema))
+        yield sink.drain()
+
+    if writer is None:
+        schema = pa.schema([
+            pa.field(col, _description_type(d[1], dbapi) or pa.string())
+            for col, d in zip(columns, description or [(None, None)] * len(columns))
+        ])
+        writer = pq.ParquetWriter(sink, schema, compression=codec)
+    writer.close()
+    yield sink.drain()
+
+def open_export(sql_command: str, db_path: str, fmt: str = "csv", compression: str = "none"):
+    """
+    Starts a streaming export of a single read-only statement.
+
+    The statement is executed before this returns (so SQL errors surface as
+    ExportError), then rows are pulled from a server-side cursor
+    EXPORT_CHUNK_ROWS at a time. Returns (byte_iterator, media_type, filename).
+    """
+    fmt = (fmt or "csv").lower()
+    compression = (compression or "none").lower()
+    if fmt not in FORMATS:
+        raise ExportError(f"Unsupported format: {fmt}")
+    if compression not in COMPRESSIONS:
+        raise ExportError(f"Unsupported compression: {compression}")
+
+    statements = [s.strip() for s in sqlparse.split(sql_command) if s.strip()]
+    if len(statements) != 1:
+        raise ExportError("Export requires exactly one statement")
+    stmt = statements[0].rstrip(";")
+    if not stmt.upper().startswith(READ_ONLY_PREFIXES):
+        raise ExportError("Only read-only statements can be exported")
+
+    if fmt == "parquet":
+        try:
+            import pyarrow.parquet  # noqa: F401
+        except ImportError:
+            raise ExportError("Parquet export requires the 'pyarrow' package")
+
+    # Parquet compresses inside the file; other formats are wrapped in a stream compressor
+    compressor = None if fmt == "parquet" else _compressor(compression)
+
+    conn = None
+    try:
+        # Exports are read-only, so prefer a replica when one is configured
+        replica_conn = None if requires_primary(stmt) else connect_replica(db_path)[0]
+        conn = replica_conn or get_engine(db_path).connect()
+        result = conn.execution_options(
+            stream_results=True, max_row_buffer=EXPORT_CHUNK_ROWS
+        ).execute(text(stmt))
+        columns = list(result.keys())
+        description = result.cursor.description if result.cursor is not None else None
+        dbapi = getattr(conn.dialect, "loaded_dbapi", None) or conn.dialect.dbapi
+    except Exception as e:
+        if conn is not None:
+            conn.close()
+        raise ExportError(str(e))
+
+    def generate():
+        try:
+            partitions = result.partitions(EXPORT_CHUNK_ROWS)
+            if fmt == "csv":
+                chunks = _csv_chunks(columns, partitions)
+            elif fmt == "ndjson":
+                chunks = _ndjson_chunks(columns, partitions)
+            else:
+                chunks = _parquet_chunks(columns, partitions, compression, description, dbapi)
+
+            for chunk in chunks:
+                if compressor:
+                    chunk = compressor.compress(chunk)
+                if chunk:
+                    yield chunk
+            if compressor:
+                tail = compressor.flush()
+                if tail:
+                    yield tail
+        finally:
+            result.close()
+            conn.close()
+
+    media_type, ext = FORMATS[fmt]
+    if fmt != "parquet" and compression != "none":
+        media_type, suffix = COMPRESSIONS[compression]
+        ext += suffix
+    return generate(), media_type, f"export.{ext}"
@@ -3,20 +3,41 @@ import os
 import hashlib
 import uuid
 import time
-from fastapi import FastAPI, HTTPException, Depends
+import json
+import threading
+import sqlparse
+from fastapi import FastAPI, HTTPException, Depends, Header
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, FileResponse
 from pydantic import BaseModel
 from typing import Optional
-from sqlalchemy import create_engine, text, inspect
+from collections import OrderedDict
+from sqlalchemy import text, inspect
 from dotenv import load_dotenv
 
 # Load env vars
 load_dotenv()
 
 try:
-    from .agent import run_sql_agent
+    from .agent import run_sql_agent, MODEL_NAME
+    from .metrics import pool_status, query_latency_percentiles, llm_status
+    from .connections import get_base_engine, resolve_target, peek_engine, get_target_breaker, CircuitOpenError
+    from .replicas import get_replica_set
+    from . import snapshots
+    from . import slowlog
+    from .export import open_export, ExportError
+    from .approx import APPROX_SAMPLE_PERCENT, refine_percents
+    from . import profiling
 except ImportError:
-    from agent import run_sql_agent
+    from agent import run_sql_agent, MODEL_NAME
+    from metrics import pool_status, query_latency_percentiles, llm_status
+    from connections import get_base_engine, resolve_target, peek_engine, get_target_breaker, CircuitOpenError
+    from replicas import get_replica_set
+    import snapshots
+    import slowlog
+    from export import open_export, ExportError
+    from approx import APPROX_SAMPLE_PERCENT, refine_percents
+    import profiling
 
 # 1. Initialize the FastAPI app
 app = FastAPI(title="AI SQL Workbench API")
@@ -30,14 +51,21 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Operator-only features (request profiling, slow query log) require X-Admin-Token
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+# Opt-in request profiling (see profiling.py); a header check when not profiling
+app.add_middleware(profiling.ProfilingMiddleware, admin_token=ADMIN_TOKEN)
+
 # 3. Database Setup (Supabase / Postgres)
 DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     print("WARNING: DATABASE_URL not found in .env. Falling back to in-memory SQLite (Data will be lost).")
     DATABASE_URL = "sqlite:///:memory:"
 
-# Create main engine for User Management
-engine = create_engine(DATABASE_URL)
+# Main engine for User Management. User sandboxes share this same pool
+# (see connections.resolve_target), so connection count does not grow per user.
+engine = get_base_engine(DATABASE_URL, pinned=True)
 
 def get_user_db_path(user_email: str = None) -> str:
     """
@@ -92,6 +120,19 @@ def init_users_db():
 # Initialize on startup
 init_users_db()
 
+@app.on_event("startup")
+def init_slow_query_log():
+    slowlog.init_slowlog_store()
+
+@app.on_event("startup")
+def start_snapshot_scheduler():
+    snapshots.init_snapshot_store()
+    snapshots.scheduler.start()
+
+@app.on_event("shutdown")
+def stop_snapshot_scheduler():
+    snapshots.scheduler.stop()
+
 # 4. Data Models (Unchanged)
 class QueryRequest(BaseModel):
     prompt: str
@@ -99,17 +140,41 @@ class QueryRequest(BaseModel):
     safe_mode: bool = False
     user_email: Optional[str] = None
     connection_uri: Optional[str] = None
+    approximate: bool = False  # Estimate aggregates from a sample
+    sample_percent: Optional[float] = None
 
 class ExecuteRequest(BaseModel):
     sql: str
     user_email: Optional[str] = None
     connection_uri: Optional[str] = None
+    approximate: bool = False  # Estimate aggregates from a sample
+    sample_percent: Optional[float] = None
+    progressive: bool = False  # Stream estimates refined up to the exact answer
 
 class SchemaRequest(BaseModel):
     user_email: Optional[str] = None
     connection_uri: Optional[str] = None
     table_name: Optional[str] = None
 
+class ExportRequest(BaseModel):
+    sql: str
+    user_email: Optional[str] = None
+    connection_uri: Optional[str] = None
+    format: str = "csv"  # csv, ndjson, parquet
+    compression: str = "none"  # none, gzip, zstd
+
+class WidgetRequest(BaseModel):
+    sql: str
+    user_email: Optional[str] = None
+    connection_uri: Optional[str] = None
+    chart_type: str = "table"
+    refresh_interval: int = 300  # seconds
+    incremental_column: Optional[str] = None  # Monotonic column for append-only tables
+
+class ProfilingSettings(BaseModel):
+    enabled: bool
+    sample_rate: Optional[float] = None
+
 class UserRegister(BaseModel):
     name: str
     email: str
@@ -182,36 +247,106 @@ def login_user(user: UserLogin):
         raise HTTPException(status_code=500, detail=str(e))
 
 # 6. API Routes
+# Deep health results per target: {target_key: {'timestamp': time, 'probe': dict}}
+# Keys are hashes (see health_cache_key), so no credentials are kept here.
+HEALTH_CACHE = OrderedDict()
+# Longer than the dashboard's 30s poll, so polling mostly hits the cache
+HEALTH_CACHE_TTL = int(os.getenv("HEALTH_CACHE_TTL", "60"))  # seconds
+HEALTH_CACHE_MAX_ENTRIES = int(os.getenv("HEALTH_CACHE_MAX_ENTRIES", "256"))
+HEALTH_CACHE_LOCK = threading.Lock()
+
+def health_cache_key(db_target: str) -> str:
+    # Probe results (table lists) depend on the credentials and schema, so the
+    # whole target is part of the key, but only as a digest
+    return hashlib.sha256(db_target.encode("utf-8")).hexdigest()
+
+def store_health_probe(key: str, probe: dict, now: float) -> dict:
+    entry = {'timestamp': now, 'probe': probe}
+    with HEALTH_CACHE_LOCK:
+        HEALTH_CACHE[key] = entry
+        HEALTH_CACHE.move_to_end(key)
+        for stale in [k for k, e in HEALTH_CACHE.items() if now - e['timestamp'] >= HEALTH_CACHE_TTL]:
+            del HEALTH_CACHE[stale]
+        while len(HEALTH_CACHE) > HEALTH_CACHE_MAX_ENTRIES:
+            HEALTH_CACHE.popitem(last=False)
+    return entry
+
+@app.get("/health/live")
+def liveness_check():
+    """
+    Liveness probe. Does not touch any database.
+    """
+    return {"status": "online", "timestamp": time.time()}
+
+def probe_database(db_target: str) -> dict:
+    """
+    Checks out a pooled connection and lists tables. This is the expensive
+    part of /health, so results are cached per target for HEALTH_CACHE_TTL.
+    """
+    try:
+        target_engine, schema = resolve_target(db_target)
+        started = time.perf_counter()
+        with target_engine.connect() as conn:
+            checkout_ms = (time.perf_counter() - started) * 1000
+            table_names = inspect(conn).get_table_names(schema=schema)
+    except Exception as e:
+        print(f"Health Check Error: {e}")
+        return {"status": "error", "message": str(e)}
+
+    return {
+        "status": "online",
+        "message": "Datalk Backend & Database Ready",
+        "checkout_latency_ms": round(checkout_ms, 2),
+        "table_count": len(table_names),
+        "tables": table_names,
+    }
+
 @app.get("/health")
-def health_check(user_email: Optional[str] = None, connection_uri: Optional[str] = None):
+def health_check(user_email: Optional[str] = None, connection_uri: Optional[str] = None, refresh: bool = False):
+    """
+    Readiness check: cached database probe plus live pool, query latency and LLM stats.
+    """
     # Determine DB Source
     db_target = get_user_db_path(user_email)
     
     if connection_uri:
         db_target = connection_uri
 
-    # Check Connectivity
-    try:
-        temp_engine = create_engine(db_target)
-        inspector = inspect(temp_engine)
-        table_names = inspector.get_table_names() # This respects search_path for Postgres!
-        table_count = len(table_names)
-        status_msg = "Datalk Backend & Database Ready"
-    except Exception as e:
-        print(f"Health Check Error: {e}")
+    now = time.time()
+    cache_key = health_cache_key(db_target)
+    entry = HEALTH_CACHE.get(cache_key)
+    if entry and not refresh and now - entry['timestamp'] < HEALTH_CACHE_TTL:
+        probe = entry['probe']
+        cached = True
+    else:
+        probe = probe_database(db_target)
+        entry = store_health_probe(cache_key, probe, now)
+        cached = False
+
+    if probe["status"] == "error":
         return {
             "status": "error",
-            "message": str(e),
-            "timestamp": time.time()
+            "message": probe["message"],
+            "circuit": get_target_breaker(db_target).status(),
+            "cached": cached,
+            "timestamp": now
         }
 
+    replica_set = get_replica_set(db_target)
+    # Never resolve/create an engine here: that would consult the circuit breaker
+    target_engine = peek_engine(db_target)
+
     return {
-        "status": "online",
-        "message": status_msg,
+        **probe,
+        "replicas": replica_set.status() if replica_set else [],
+        "circuit": get_target_breaker(db_target).status(),
         "db_url_masked": db_target.split("@")[-1] if "@" in db_target else "sqlite",
-        "table_count": table_count,
-        "tables": table_names, # Connection test
-        "timestamp": time.time()
+        "pool": pool_status(target_engine) if target_engine else None,
+        "query_latency": query_latency_percentiles(db_target),
+        "llm": {"model": MODEL_NAME, **llm_status()},
+        "cached": cached,
+        "checked_at": entry['timestamp'],
+        "timestamp": now
     }
 
 @app.post("/schema")
@@ -226,12 +361,12 @@ def get_schema(request: SchemaRequest):
         else:
             db_target = get_user_db_path(request.user_email)
 
-        engine = create_engine(db_target)
-        inspector = inspect(engine)
+        target_engine, schema = resolve_target(db_target)
+        inspector = inspect(target_engine)
              
         if request.table_name:
             # Generic column fetch
-            cols_info = inspector.get_columns(request.table_name)
+            cols_info = inspector.get_columns(request.table_name, schema=schema)
             columns = []
             for col in cols_info:
                 columns.append({
@@ -241,7 +376,7 @@ def get_schema(request: SchemaRequest):
                 })
             return {"columns": columns}
         else:
-            tables = inspector.get_table_names()
+            tables = inspector.get_table_names(schema=schema)
             return {"tables": tables}
 
     except Exception as e:
@@ -257,25 +392,56 @@ async def ask_ai(request: QueryRequest):
         db_target = request.connection_uri
     else:
         db_target = get_user_db_path(request.user_email)
+
+    # Don't spend an LLM call on a database that is known to be down
+    try:
+        get_target_breaker(db_target).raise_if_open()
+    except CircuitOpenError as e:
+        return {"status": "error", "error_message": str(e), "sql": "N/A"}
         
-    return run_sql_agent(request.prompt, db_target, request.history, request.safe_mode)
+    approximate = (request.sample_percent or APPROX_SAMPLE_PERCENT) if request.approximate else None
+    return run_sql_agent(request.prompt, db_target, request.history, request.safe_mode, approximate)
 
 @app.post("/execute")
 async def execute_sql(request: ExecuteRequest):
     print(f"DEBUG: /execute called. URI present: {bool(request.connection_uri)}")
     try:
-        from .agent import execute_sql_commands
+        from .agent import execute_sql_commands, READ_ONLY_PREFIXES
     except ImportError:
-        from agent import execute_sql_commands
+        from agent import execute_sql_commands, READ_ONLY_PREFIXES
         
     # Determine DB Source
     if request.connection_uri:
         db_target = request.connection_uri
     else:
         db_target = get_user_db_path(request.user_email)
+
+    approximate = (request.sample_percent or APPROX_SAMPLE_PERCENT) if request.approximate else None
+
+    if approximate and request.progressive:
+        # Re-running is only safe for read-only SQL
+        statements = [s.strip() for s in sqlparse.split(request.sql) if s.strip()]
+        if not all(s.upper().startswith(READ_ONLY_PREFIXES) for s in statements):
+            raise HTTPException(status_code=400, detail="Progressive mode only supports read-only statements")
+
+        def stages():
+            for percent in refine_percents(approximate):
+                datasets = execute_sql_commands(request.sql, db_target, approximate=percent if percent < 100 else None)
+                final = percent >= 100 or not any(d.get("approximate") for d in datasets)
+                yield json.dumps({
+                    "status": "success",
+                    "sample_percent": percent,
+                    "approximate": not final,
+                    "final": final,
+                    "datasets": datasets
+                }, default=str) + "\n"
+                if final:
+                    break
+
+        return StreamingResponse(stages(), media_type="application/x-ndjson")
     
     try:
-        datasets = execute_sql_commands(request.sql, db_target)
+        datasets = execute_sql_commands(request.sql, db_target, approximate=approximate)
         return {
             "status": "success",
             "datasets": datasets
@@ -286,6 +452,130 @@ async def execute_sql(request: ExecuteRequest):
             "error_message": str(e)
         }
 
+@app.post("/export")
+def export_sql(request: ExportRequest):
+    """
+    Streams a query's full result set as a file without materialising it in memory.
+    """
+    if request.connection_uri:
+        db_target = request.connection_uri
+    else:
+        db_target = get_user_db_path(request.user_email)
+
+    try:
+        chunks, media_type, filename = open_export(
+            request.sql, db_target, request.format, request.compression
+        )
+    except ExportError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return StreamingResponse(
+        chunks,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    if not ADMIN_TOKEN or x_admin_token != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+# 7. Slow Query Log
+def resolve_optional_target(user_email: Optional[str], connection_uri: Optional[str]) -> Optional[str]:
+    if connection_uri:
+        return connection_uri
+    if user_email:
+        return get_user_db_path(user_email)
+    return None
+
+@app.get("/slow-queries", dependencies=[Depends(require_admin)])
+def list_slow_queries(limit: int = 20, user_email: Optional[str] = None, connection_uri: Optional[str] = None):
+    """
+    Top slow statement fingerprints by total time, with their latest plan.
+    """
+    target = resolve_optional_target(user_email, connection_uri)
+    return {"status": "success", "queries": slowlog.top_fingerprints(limit, target)}
+
+@app.get("/slow-queries/index-suggestions", dependencies=[Depends(require_admin)])
+def slow_query_index_suggestions(limit: int = 20, user_email: Optional[str] = None, connection_uri: Optional[str] = None):
+    target = resolve_optional_target(user_email, connection_uri)
+    return {"status": "success", "suggestions": slowlog.index_suggestions(limit, target)}
+
+# 8. Dashboard Widgets (served from background-refreshed snapshots)
+@app.post("/widgets")
+def register_widget(request: WidgetRequest):
+    if request.connection_uri:
+        db_target = request.connection_uri
+    else:
+        db_target = get_user_db_path(request.user_email)
+
+    try:
+        widget = snapshots.register_widget(
+            request.sql,
+            db_target,
+            request.refresh_interval,
+            user_email=request.user_email,
+            connection_uri=request.connection_uri,
+            chart_type=request.chart_type,
+            incremental_column=request.incremental_column,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"status": "success", "widget": widget}
+
+@app.get("/widgets")
+def list_widgets(user_email: Optional[str] = None, connection_uri: Optional[str] = None):
+    widgets = snapshots.list_widgets(user_email, connection_uri, touch=True)
+    return {"status": "success", "widgets": widgets}
+
+@app.get("/widgets/{widget_id}")
+def get_widget(widget_id: str):
+    widget = snapshots.get_widget(widget_id, touch=True)
+    if not widget:
+        raise HTTPException(status_code=404, detail="Widget not found")
+    return {"status": "success", "widget": widget}
+
+@app.post("/widgets/{widget_id}/refresh")
+def refresh_widget(widget_id: str):
+    if not snapshots.refresh_widget(widget_id):
+        raise HTTPException(status_code=404, detail="Widget not found")
+    widget = snapshots.get_widget(widget_id, touch=True)
+    return {"status": "success", "widget": widget}
+
+@app.delete("/widgets/{widget_id}")
+def delete_widget(widget_id: str):
+    if not snapshots.delete_widget(widget_id):
+        raise HTTPException(status_code=404, detail="Widget not found")
+    return {"status": "success"}
+
+# 9. Request Profiling
+@app.post("/admin/profiling", dependencies=[Depends(require_admin)])
+def update_profiling(settings: ProfilingSettings):
+    profiling.settings["enabled"] = settings.enabled
+    if settings.sample_rate is not None:
+        profiling.settings["sample_rate"] = min(max(settings.sample_rate, 0.0), 1.0)
+    return {"status": "success", "profiling": profiling.settings}
+
+@app.get("/profiles", dependencies=[Depends(require_admin)])
+def list_profiles(limit: int = 50):
+    return {"status": "success", "profiles": profiling.list_profiles(limit)}
+
+@app.get("/profiles/{profile_id}", dependencies=[Depends(require_admin)])
+def get_profile(profile_id: str):
+    profile = profiling.get_profile(profile_id)
+    if not profile:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return {"status": "success", "profile": profile}
+
+@app.get("/profiles/{profile_id}/folded", dependencies=[Depends(require_admin)])
+def download_profile(profile_id: str):
+    """
+    Folded stacks for flamegraph.pl / speedscope.
+    """
+    path = profiling.folded_path(profile_id)
+    if not path:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, media_type="text/plain", filename=f"profile-{profile_id}.folded")
+
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 8000))
     uvicorn.run(
@@ -0,0 +1,79 @@
+import os
+import time
+import threading
+from collections import deque, OrderedDict
+
+try:
+    from .connections import mask_uri
+except ImportError:
+    from connections import mask_uri
+
+# Rolling window of recent query latencies per target, keyed by the target
+# without credentials: {masked_target: deque[(timestamp, seconds)]}.
+# Only the METRICS_MAX_TARGETS most recently used targets are kept.
+QUERY_LATENCY_WINDOW = 500
+METRICS_MAX_TARGETS = int(os.getenv("METRICS_MAX_TARGETS", "256"))
+_query_latencies = OrderedDict()
+_llm_status = {"available": None, "last_success": None, "last_error": None, "last_error_at": None}
+_lock = threading.Lock()
+
+def record_query_latency(db_path: str, seconds: float):
+    key = mask_uri(db_path)
+    with _lock:
+        window = _query_latencies.get(key)
+        if window is None:
+            window = _query_latencies[key] = deque(maxlen=QUERY_LATENCY_WINDOW)
+            while len(_query_latencies) > METRICS_MAX_TARGETS:
+                _query_latencies.popitem(last=False)
+        else:
+            _query_latencies.move_to_end(key)
+        window.append((time.time(), seconds))
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def query_latency_percentiles(db_path: str):
+    """
+    Returns p50/p95/p99 (in ms) over the recent query window for a target.
+    """
+    with _lock:
+        window = list(_query_latencies.get(mask_uri(db_path), ()))
+    values = sorted(seconds * 1000 for _, seconds in window)
+    return {
+        "count": len(values),
+        "p50_ms": _percentile(values, 50),
+        "p95_ms": _percentile(values, 95),
+        "p99_ms": _percentile(values, 99),
+    }
+
+def record_llm_call(ok: bool, error: str = None):
+    with _lock:
+        _llm_status["available"] = ok
+        if ok:
+            _llm_status["last_success"] = time.time()
+        else:
+            _llm_status["last_error"] = error
+            _llm_status["last_error_at"] = time.time()
+
+def llm_status():
+    with _lock:
+        return dict(_llm_status)
+
+def pool_status(engine):
+    """
+    Pool utilisation for an engine. Pools without sizing (e.g. SQLite's
+    SingletonThreadPool) only report what they support.
+    """
+    pool = engine.pool
+    status = {"pool_class": type(pool).__name__}
+    for name in ("size", "checkedout", "checkedin", "overflow"):
+        fn = getattr(pool, name, None)
+        if callable(fn):
+            status[name] = fn()
+    if "size" in status and "checkedout" in status:
+        capacity = status["size"] + max(getattr(pool, "_max_overflow", 0), 0)
+        status["utilization"] = round(status["checkedout"] / capacity, 3) if capacity else None
+    return status
@@ -0,0 +1,290 @@
+import os
+import sys
+import hmac
+import json
+import time
+import uuid
+import random
+import asyncio
+import threading
+import contextvars
+import tracemalloc
+from collections import Counter
+
+# On-demand request profiling. A request is profiled when it sends
+# `X-Profile: 1` together with a valid `X-Admin-Token`, or when sampled
+# profiling is enabled (PROFILE_REQUESTS or the admin endpoint) and it falls
+# within PROFILE_SAMPLE_RATE.
+PROFILE_DIR = os.getenv(
+    "PROFILE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "profiles")
+)
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_MAX_STORED = int(os.getenv("PROFILE_MAX_STORED", "200"))
+PROFILE_HEADER = b"x-profile"
+ADMIN_TOKEN_HEADER = b"x-admin-token"
+
+settings = {
+    "enabled": os.getenv("PROFILE_REQUESTS", "false").lower() == "true",
+    "sample_rate": float(os.getenv("PROFILE_SAMPLE_RATE", "0.01")),
+}
+
+_tracemalloc_users = 0
+_tracemalloc_lock = threading.Lock()
+# The profiler of the request being handled; copied into the request's child
+# tasks and into the contexts its threadpool calls run in
+_active_profiler = contextvars.ContextVar("active_profiler", default=None)
+
+def should_profile(scope, admin_token: str = None) -> bool:
+    """
+    Cheap per-request check; the only cost on the request path when disabled.
+    The header only works with the admin token, since profiling turns on
+    process-wide tracemalloc and writes to disk.
+    """
+    if settings["enabled"] and random.random() < settings["sample_rate"]:
+        return True
+    if not admin_token:
+        return False
+    headers = dict(scope["headers"])
+    if headers.get(PROFILE_HEADER) not in (b"1", b"true"):
+        return False
+    return hmac.compare_digest(headers.get(ADMIN_TOKEN_HEADER, b""), admin_token.encode())
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+class RequestProfiler:
+    """
+    Statistical profiler for one request.
+
+    A background thread snapshots thread stacks every PROFILE_INTERVAL_MS and
+    keeps only those running on behalf of this request: the event loop thread
+    while the request's task (or a task it spawned) is the one running, a
+    streamed response body, and threadpool workers running a call in the
+    request's context (sync endpoints, sync bodies). Concurrent requests to
+    the same endpoint are therefore kept apart.
+
+    Allocation stats come from tracemalloc over the same window. tracemalloc
+    is process-wide, so `process_traced_bytes_max` is the highest traced
+    memory of the whole process seen while polling, not this request's peak.
+    """
+    def __init__(self, method: str, path: str):
+        self.id = uuid.uuid4().hex[:12]
+        self.method = method
+        self.path = path
+        self.frames = set()
+        self.stacks = Counter()
+        self.samples = 0
+        self.traced_bytes_max = 0
+        self._loop = None
+        self._loop_ident = None
+        self._task = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._started = None
+        self._snapshot_before = None
+
+    def bind(self):
+        """
+        Called on the event loop by the task handling the request, before the
+        app runs: records the loop thread and the task, and marks the context
+        so child tasks and threadpool calls can be attributed.
+        """
+        self._loop = asyncio.get_running_loop()
+        self._loop_ident = threading.get_ident()
+        self._task = asyncio.current_task()
+        return _active_profiler.set(self)
+
+    def start(self):
+        global _tracemalloc_users
+        with _tracemalloc_lock:
+            if _tracemalloc_users == 0:
+                tracemalloc.start()
+            _tracemalloc_users += 1
+        # No reset_peak(): it would also reset the peak of overlapping profiles,
+        # so the sampler polls the traced total instead
+        self._snapshot_before = tracemalloc.take_snapshot()
+        self._started = time.perf_counter()
+        self._thread = threading.Thread(target=self._sample, name=f"profiler-{self.id}", daemon=True)
+        self._thread.start()
+
+    def watch_body(self, frame):
+        """
+        Called from the ASGI send() of the response start. If the response is
+        streamed, its body generator's frame is attributed to this request as
+        well, which covers bodies running in a task the request doesn't own.
+        """
+        while frame is not None:
+            response = frame.f_locals.get("self") if frame.f_code.co_name == "stream_response" else None
+            if response is not None:
+                body = getattr(response, "body_iterator", None)
+                body_frame = getattr(body, "ag_frame", None) or getattr(body, "gi_frame", None)
+                if body_frame is not None:
+                    self.frames.add(body_frame)
+                    # Sync iterators are wrapped by starlette's iterate_in_threadpool
+                    wrapped = body_frame.f_locals.get("iterator")
+                    if getattr(wrapped, "gi_frame", None) is not None:
+                        self.frames.add(wrapped.gi_frame)
+                return
+            frame = frame.f_back
+
+    def _owns_task(self, task):
+        if task is None:
+            return False
+        if task is self._task:
+            return True
+        get_context = getattr(task, "get_context", None)  # Python 3.12+
+        return get_context is not None and get_context().get(_active_profiler) is self
+
+    def _in_request_context(self, frame):
+        # anyio's worker threads (starlette's threadpool) keep the context the
+        # call runs in as a local of their run loop
+        if frame.f_code.co_name != "run":
+            return False
+        context = frame.f_locals.get("context")
+        return isinstance(context, contextvars.Context) and context.get(_active_profiler) is self
+
+    def _sample(self):
+        interval = PROFILE_INTERVAL_MS / 1000
+        own_ident = threading.get_ident()
+        while not self._stop.wait(interval):
+            self.traced_bytes_max = max(self.traced_bytes_max, tracemalloc.get_traced_memory()[0])
+            frames = sys._current_frames()
+            # Read right after the stacks; a switch in between can misattribute one sample
+            loop_owned = self._owns_task(asyncio.current_task(self._loop))
+            for ident, frame in frames.items():
+                if ident == own_ident:
+                    continue
+                on_loop = ident == self._loop_ident
+                stack = []
+                in_request = on_loop and loop_owned
+                while frame is not None:
+                    if not in_request and (frame in self.frames
+                                           or (not on_loop and self._in_request_context(frame))):
+                        in_request = True
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                if in_request:
+                    self.stacks[";".join(reversed(stack))] += 1
+                    self.samples += 1
+
+    def stop(self, status_code: int = None):
+        global _tracemalloc_users
+        self._stop.set()
+        self._thread.join()
+        duration_ms = (time.perf_counter() - self._started) * 1000
+
+        traced_max = max(self.traced_bytes_max, tracemalloc.get_traced_memory()[0])
+        top_allocations = [
+            {"location": str(stat.traceback), "size_diff_bytes": stat.size_diff, "count_diff": stat.count_diff}
+            for stat in tracemalloc.take_snapshot().compare_to(self._snapshot_before, "lineno")[:15]
+        ]
+        with _tracemalloc_lock:
+            _tracemalloc_users -= 1
+            if _tracemalloc_users == 0:
+                tracemalloc.stop()
+
+        meta = {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "status_code": status_code,
+            "duration_ms": round(duration_ms, 2),
+            "samples": self.samples,
+            "interval_ms": PROFILE_INTERVAL_MS,
+            # Process-wide and polled: not a per-request peak
+            "process_traced_bytes_max": traced_max,
+            "top_allocations": top_allocations,
+            "created_at": time.time(),
+        }
+        _save(meta, self.stacks)
+        return meta
+
+class ProfilingMiddleware:
+    """
+    Pure ASGI middleware: requests that aren't profiled go straight to the
+    app after should_profile. Profiled requests are measured until the last
+    body chunk is sent, so streamed responses are covered; starting and
+    stopping (snapshots, file writes) happen off the event loop.
+    """
+    def __init__(self, app, admin_token: str = None):
+        self.app = app
+        self.admin_token = admin_token
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not should_profile(scope, self.admin_token):
+            await self.app(scope, receive, send)
+            return
+
+        profiler = RequestProfiler(scope["method"], scope["path"])
+        token = profiler.bind()
+        await asyncio.to_thread(profiler.start)
+        status = {}
+
+        async def send_with_profile_id(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                profiler.watch_body(sys._getframe(1))
+                message = {
+                    **message,
+                    "headers": list(message.get("headers", [])) + [(b"x-profile-id", profiler.id.encode())],
+                }
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            _active_profiler.reset(token)
+            await asyncio.to_thread(profiler.stop, status.get("code"))
+
+def _save(meta, stacks):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    # Folded stacks ("a;b;c 12"), readable by flamegraph.pl and speedscope
+    with open(os.path.join(PROFILE_DIR, f"{meta['id']}.folded"), "w") as f:
+        for stack, count in stacks.most_common():
+            f.write(f"{stack} {count}\n")
+    with open(os.path.join(PROFILE_DIR, f"{meta['id']}.json"), "w") as f:
+        json.dump(meta, f)
+    _prune()
+
+def _prune():
+    metas = sorted(
+        (name for name in os.listdir(PROFILE_DIR) if name.endswith(".json")),
+        key=lambda name: os.path.getmtime(os.path.join(PROFILE_DIR, name))
+    )
+    for name in metas[:-PROFILE_MAX_STORED]:
+        profile_id = name[:-len(".json")]
+        for ext in (".json", ".folded"):
+            try:
+                os.remove(os.path.join(PROFILE_DIR, profile_id + ext))
+            except FileNotFoundError:
+                pass
+
+def _valid_id(profile_id: str) -> bool:
+    return profile_id.isalnum()
+
+def list_profiles(limit: int = 50):
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    metas = []
+    for name in os.listdir(PROFILE_DIR):
+        if name.endswith(".json"):
+            with open(os.path.join(PROFILE_DIR, name)) as f:
+                meta = json.load(f)
+            meta.pop("top_allocations", None)
+            metas.append(meta)
+    return sorted(metas, key=lambda m: m["created_at"], reverse=True)[:limit]
+
+def get_profile(profile_id: str):
+    path = os.path.join(PROFILE_DIR, f"{profile_id}.json")
+    if not _valid_id(profile_id) or not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def folded_path(profile_id: str):
+    path = os.path.join(PROFILE_DIR, f"{profile_id}.folded")
+    if not _valid_id(profile_id) or not os.path.exists(path):
+        return None
+    return path
@@ -0,0 +1,190 @@
+import os
+import time
+import itertools
+import threading
+from urllib.parse import urlsplit, urlunsplit
+import sqlparse
+from sqlparse import tokens as T
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import DBAPIError
+
+try:
+    from .connections import get_db_uri, get_base_engine, split_replica_uri, split_tenant_uri
+except ImportError:
+    from connections import get_db_uri, get_base_engine, split_replica_uri, split_tenant_uri
+
+# Global replicas for DATABASE_URL (comma separated full URIs)
+DATABASE_REPLICA_URLS = [u.strip() for u in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if u.strip()]
+REPLICA_STRATEGY = os.getenv("REPLICA_STRATEGY", "round_robin")  # round_robin, least_latency
+REPLICA_RETRY_SECONDS = int(os.getenv("REPLICA_RETRY_SECONDS", "30"))
+LATENCY_EWMA_ALPHA = 0.2
+# Keywords that make a SELECT/WITH statement unsafe for a replica: SELECT INTO,
+# row locks (FOR SHARE / LOCK IN SHARE MODE; FOR UPDATE is caught as DML)
+_PRIMARY_KEYWORDS = {"INTO", "SHARE", "LOCK"}
+
+# {primary_base_uri: ReplicaSet}
+_REPLICA_SETS = {}
+_REPLICA_SETS_LOCK = threading.Lock()
+
+class ReplicaSet:
+    """
+    Read replicas of one primary, with health tracking.
+    A replica that fails to connect is skipped for REPLICA_RETRY_SECONDS.
+    """
+    def __init__(self, uris, strategy=REPLICA_STRATEGY):
+        self.uris = list(uris)
+        self.strategy = strategy if strategy in ("round_robin", "least_latency") else "round_robin"
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._state = {
+            uri: {"latency_ms": None, "failures": 0, "down_until": 0.0, "last_error": None}
+            for uri in self.uris
+        }
+
+    def candidates(self):
+        """
+        Healthy replicas in the order they should be tried.
+        """
+        now = time.time()
+        with self._lock:
+            healthy = [u for u in self.uris if self._state[u]["down_until"] <= now]
+            if not healthy:
+                return []
+            if self.strategy == "least_latency":
+                # Unmeasured replicas sort first so they get sampled
+                return sorted(healthy, key=lambda u: self._state[u]["latency_ms"] or 0.0)
+            start = next(self._counter) % len(healthy)
+            return healthy[start:] + healthy[:start]
+
+    def observe(self, uri, seconds):
+        with self._lock:
+            state = self._state[uri]
+            ms = seconds * 1000
+            if state["latency_ms"] is None:
+                state["latency_ms"] = ms
+            else:
+                state["latency_ms"] += LATENCY_EWMA_ALPHA * (ms - state["latency_ms"])
+
+    def mark_up(self, uri):
+        with self._lock:
+            self._state[uri].update(failures=0, down_until=0.0, last_error=None)
+
+    def mark_down(self, uri, error):
+        with self._lock:
+            state = self._state[uri]
+            state["failures"] += 1
+            state["down_until"] = time.time() + REPLICA_RETRY_SECONDS
+            state["last_error"] = str(error)
+
+    def status(self):
+        now = time.time()
+        with self._lock:
+            return [
+                {
+                    "replica": uri.split("@")[-1],
+                    "healthy": state["down_until"] <= now,
+                    "latency_ms": round(state["latency_ms"], 2) if state["latency_ms"] is not None else None,
+                    "failures": state["failures"],
+                    "last_error": state["last_error"],
+                }
+                for uri, state in self._state.items()
+            ]
+
+def requires_primary(stmt: str) -> bool:
+    """
+    True for read-only-looking statements that must run on the primary:
+    row-locking SELECTs, SELECT INTO and data-modifying CTEs.
+    """
+    for statement in sqlparse.parse(stmt):
+        for tok in statement.flatten():
+            if tok.ttype in T.Keyword.DML and tok.normalized != "SELECT":
+                return True
+            if tok.ttype in T.Keyword and tok.normalized in _PRIMARY_KEYWORDS:
+                return True
+    return False
+
+def _dbapi_error(error):
+    # pandas wraps driver errors in its own DatabaseError
+    while error is not None and not isinstance(error, DBAPIError):
+        error = error.__cause__
+    return error
+
+def replica_unreachable(error) -> bool:
+    """
+    True when a query failed because the replica connection was lost.
+    """
+    error = _dbapi_error(error)
+    return error is not None and error.connection_invalidated
+
+def rejected_as_read_only(error) -> bool:
+    """
+    True when a replica refused a statement because it is read-only
+    (Postgres SQLSTATE 25006, MySQL --read-only / read-only transaction).
+    """
+    orig = getattr(_dbapi_error(error), "orig", None)
+    if getattr(orig, "pgcode", None) == "25006" or getattr(orig, "sqlstate", None) == "25006":
+        return True
+    if orig is not None and getattr(orig, "args", None) and orig.args[0] in (1290, 1792):
+        return True
+    message = str(error).lower()
+    return "read-only transaction" in message or "--read-only" in message
+
+def _replace_host(base_uri, host):
+    parts = urlsplit(base_uri)
+    userinfo = parts.netloc.rsplit("@", 1)[0] + "@" if "@" in parts.netloc else ""
+    return urlunsplit(parts._replace(netloc=userinfo + host))
+
+def _same_uri(a, b):
+    try:
+        return bool(a and b) and make_url(a) == make_url(b)
+    except Exception:
+        return a == b
+
+def get_replica_set(db_path: str):
+    """
+    Returns the ReplicaSet for a target, or None when it has no replicas.
+    Replicas come from `replica_hosts` on the connection URI or, for the main
+    DATABASE_URL, from DATABASE_REPLICA_URLS.
+    """
+    db_uri, hosts, strategy = split_replica_uri(get_db_uri(db_path))
+    base_uri = split_tenant_uri(db_uri)[0]
+
+    if hosts:
+        uris = [_replace_host(base_uri, h) for h in hosts]
+    elif DATABASE_REPLICA_URLS and _same_uri(base_uri, os.getenv("DATABASE_URL")):
+        uris = DATABASE_REPLICA_URLS
+    else:
+        return None
+
+    key = (base_uri, tuple(uris), strategy)
+    replica_set = _REPLICA_SETS.get(key)
+    if replica_set is None:
+        with _REPLICA_SETS_LOCK:
+            replica_set = _REPLICA_SETS.setdefault(key, ReplicaSet(uris, strategy or REPLICA_STRATEGY))
+    return replica_set
+
+def connect_replica(db_path: str):
+    """
+    Opens a connection to a healthy replica of the target, applying the
+    tenant schema if any. Returns (connection, replica_uri), or (None, None)
+    when there are no replicas or none could be reached.
+    """
+    replica_set = get_replica_set(db_path)
+    if replica_set is None:
+        return None, None
+
+    schema = split_tenant_uri(split_replica_uri(get_db_uri(db_path))[0])[1]
+    for uri in replica_set.candidates():
+        try:
+            # The global replicas of DATABASE_URL are as long-lived as the primary
+            engine = get_base_engine(uri, pinned=uri in DATABASE_REPLICA_URLS)
+            if schema and engine.dialect.name == "postgresql":
+                engine = engine.execution_options(tenant_schema=schema)
+            conn = engine.connect()
+        except Exception as e:
+            print(f"WARNING: Replica {uri.split('@')[-1]} unavailable: {e}")
+            replica_set.mark_down(uri, e)
+            continue
+        replica_set.mark_up(uri)
+        return conn, uri
+    return None, None
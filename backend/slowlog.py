@@ -0,0 +1,417 @@
+import os
+import re
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import sqlparse
+from sqlparse import tokens as T
+from sqlalchemy import text
+
+try:
+    from .connections import get_engine, mask_uri
+    from .replicas import connect_replica
+except ImportError:
+    from connections import get_engine, mask_uri
+    from replicas import connect_replica
+
+# Local store of statements slower than SLOW_QUERY_THRESHOLD_MS, with their plans.
+SLOW_QUERY_DB_PATH = os.getenv(
+    "SLOW_QUERY_DB_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "slow_queries.sqlite")
+)
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv("SLOW_QUERY_THRESHOLD_MS", "500"))
+SLOW_QUERY_MAX_ENTRIES = int(os.getenv("SLOW_QUERY_MAX_ENTRIES", "5000"))
+# EXPLAIN ANALYZE re-runs the statement, so it is only used for plain SELECTs
+# on Postgres, inside a rolled-back transaction with this statement timeout.
+SLOW_QUERY_EXPLAIN_ANALYZE = os.getenv("SLOW_QUERY_EXPLAIN_ANALYZE", "true").lower() == "true"
+SLOW_QUERY_EXPLAIN_TIMEOUT_MS = int(os.getenv("SLOW_QUERY_EXPLAIN_TIMEOUT_MS", "10000"))
+# A plan is captured at most once per fingerprint and target in this window;
+# other occurrences reuse its index candidates. Occurrences beyond
+# SLOW_QUERY_MAX_PENDING queued recordings are dropped.
+SLOW_QUERY_PLAN_INTERVAL = int(os.getenv("SLOW_QUERY_PLAN_INTERVAL", "3600"))
+SLOW_QUERY_MAX_PENDING = int(os.getenv("SLOW_QUERY_MAX_PENDING", "100"))
+
+_WRITE_KEYWORDS = re.compile(r"\b(INSERT|UPDATE|DELETE|MERGE|TRUNCATE|DROP|ALTER|CREATE|GRANT|CALL)\b", re.I)
+_store_lock = threading.Lock()
+_store_ready = False
+# Plans are captured off the request path, one at a time
+_capture_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="slowlog")
+_pending_lock = threading.Lock()
+_pending = 0
+# {(fingerprint, masked_target): time the last plan capture was scheduled}
+_plan_scheduled = {}
+
+@contextmanager
+def _connect():
+    conn = sqlite3.connect(SLOW_QUERY_DB_PATH, timeout=10)
+    conn.row_factory = sqlite3.Row
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+def init_slowlog_store():
+    global _store_ready
+    with _store_lock, _connect() as conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS slow_queries (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                fingerprint TEXT NOT NULL,
+                normalized TEXT NOT NULL,
+                sql TEXT NOT NULL,
+                target TEXT,
+                duration_ms REAL NOT NULL,
+                row_count INTEGER,
+                plan TEXT,
+                plan_analyzed INTEGER DEFAULT 0,
+                candidates TEXT,
+                created_at REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_slow_queries_fingerprint ON slow_queries (fingerprint)")
+    _store_ready = True
+
+def fingerprint(sql: str):
+    """
+    Normalises a statement so that queries differing only in literals group
+    together. Returns (fingerprint_hash, normalized_sql).
+    """
+    parts = []
+    for statement in sqlparse.parse(sql):
+        for tok in statement.flatten():
+            if tok.ttype in T.Comment:
+                continue
+            # Only value literals; String.Symbol is a quoted identifier ("orders")
+            if tok.ttype in T.Literal.Number or tok.ttype in T.Literal.String.Single:
+                parts.append("?")
+            elif tok.is_whitespace:
+                parts.append(" ")
+            elif tok.is_keyword:
+                parts.append(tok.value.upper())
+            else:
+                parts.append(tok.value)
+    normalized = re.sub(r"\s+", " ", "".join(parts)).strip().rstrip(";").strip()
+    normalized = re.sub(r"\(\s*\?(?:\s*,\s*\?)+\s*\)", "(?+)", normalized)  # IN (...) lists
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()[:16], normalized
+
+def _capture_plan(stmt: str, db_path: str, params: dict = None, duration_ms: float = None):
+    """
+    Returns (plan, analyzed, dialect_name). Runs on a replica when one is
+    configured. Statements that cannot be explained return a None plan.
+    ANALYZE is skipped when the statement already took longer than the
+    EXPLAIN timeout, and a plain EXPLAIN is used if the ANALYZE run fails.
+    """
+    upper = stmt.upper()
+    is_select = upper.startswith(("SELECT", "WITH")) and not _WRITE_KEYWORDS.search(stmt)
+
+    conn = connect_replica(db_path)[0] or get_engine(db_path).connect()
+    try:
+        dialect = conn.dialect.name
+        analyzed = False
+        if dialect == "postgresql":
+            raw = None
+            if (is_select and SLOW_QUERY_EXPLAIN_ANALYZE
+                    and (duration_ms is None or duration_ms < SLOW_QUERY_EXPLAIN_TIMEOUT_MS)):
+                try:
+                    conn.exec_driver_sql(f"SET LOCAL statement_timeout = {SLOW_QUERY_EXPLAIN_TIMEOUT_MS}")
+                    raw = conn.execute(
+                        text("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + stmt), params or {}
+                    ).scalar()
+                    analyzed = True
+                except Exception as e:
+                    print(f"DEBUG: EXPLAIN ANALYZE failed, falling back to EXPLAIN: {e}")
+                    # The failed statement aborted the transaction
+                    conn.rollback()
+            if raw is None:
+                raw = conn.execute(text("EXPLAIN (FORMAT JSON) " + stmt), params or {}).scalar()
+            plan = raw if isinstance(raw, (list, dict)) else json.loads(raw)
+        elif dialect == "mysql":
+            raw = conn.execute(text("EXPLAIN FORMAT=JSON " + stmt), params or {}).scalar()
+            plan = json.loads(raw)
+        elif dialect == "sqlite":
+            rows = conn.execute(text("EXPLAIN QUERY PLAN " + stmt), params or {}).fetchall()
+            plan = [row[-1] for row in rows]
+        else:
+            return None, False, dialect
+        return plan, analyzed, dialect
+    finally:
+        # Never keep anything EXPLAIN ANALYZE may have done
+        conn.rollback()
+        conn.close()
+
+# --- Index candidates -------------------------------------------------------
+
+# Column on the left of a comparison, allowing for casts: "((status)::text = 'x'::text)"
+_PG_COLUMN_REF = re.compile(r"(?:\b([A-Za-z_]\w*)\.)?\b([A-Za-z_]\w*)\)?(?:::[\w ]+?)?\s*(?:=|<>|!=|<=|>=|<|>|~~\*?|\bIS\b|\bIN\b)")
+_PG_QUALIFIED_REF = re.compile(r"\b([A-Za-z_]\w*)\.([A-Za-z_]\w*)\b")
+_SQL_ALIAS = re.compile(r"\b(?:FROM|JOIN)\s+([A-Za-z_][\w.]*)(?:\s+(?:AS\s+)?([A-Za-z_]\w*))?", re.I)
+_SQL_CONDITION = re.compile(r"\b(?:WHERE|ON|AND|OR)\s+\(?\s*(?:([A-Za-z_]\w*)\.)?([A-Za-z_]\w*)\s*(?:=|<>|!=|<=|>=|<|>|\bLIKE\b|\bIN\b|\bBETWEEN\b|\bIS\b)", re.I)
+_SQL_RESERVED = {"select", "where", "on", "and", "or", "not", "null", "exists", "case", "when", "join", "left",
+                 "right", "inner", "outer", "group", "order", "limit", "having", "as", "by", "lateral"}
+
+def _pg_candidates(plan):
+    aliases = {}
+    conditions = []  # (kind, expression, relation or None)
+
+    def walk(node):
+        relation = node.get("Relation Name")
+        if relation:
+            aliases[node.get("Alias", relation)] = relation
+        if relation and node.get("Node Type") == "Seq Scan" and node.get("Filter"):
+            conditions.append(("filter", node["Filter"], relation))
+        for key in ("Hash Cond", "Merge Cond", "Join Filter"):
+            if node.get(key):
+                conditions.append(("join", node[key], None))
+        for child in node.get("Plans", []):
+            walk(child)
+
+    for entry in plan if isinstance(plan, list) else [plan]:
+        walk(entry.get("Plan", entry))
+
+    candidates = []
+    for kind, expr, relation in conditions:
+        # Join conditions reference both sides as alias.column
+        refs = _PG_QUALIFIED_REF.findall(expr) if kind == "join" else _PG_COLUMN_REF.findall(expr)
+        for alias, column in refs:
+            table = aliases.get(alias) if alias else relation
+            if table and column.lower() not in _SQL_RESERVED:
+                candidates.append({"table": table, "column": column, "kind": kind})
+    return candidates
+
+def _mysql_candidates(plan):
+    candidates = []
+
+    def walk(node):
+        if isinstance(node, dict):
+            if node.get("access_type") == "ALL" and node.get("table_name"):
+                condition = node.get("attached_condition", "")
+                for column in re.findall(r"`[^`]+`\.`" + re.escape(node["table_name"]) + r"`\.`([^`]+)`", condition):
+                    candidates.append({"table": node["table_name"], "column": column, "kind": "filter"})
+            for value in node.values():
+                walk(value)
+        elif isinstance(node, list):
+            for value in node:
+                walk(value)
+
+    walk(plan)
+    return candidates
+
+def _sql_candidates(stmt, scanned_tables=None):
+    """
+    Text heuristic for dialects whose plans carry no column info (SQLite):
+    columns compared in WHERE/ON clauses, limited to fully scanned tables.
+    """
+    aliases = {}
+    tables = []
+    for table, alias in _SQL_ALIAS.findall(stmt):
+        if alias and alias.lower() in _SQL_RESERVED:
+            alias = ""
+        aliases[(alias or table).lower()] = table
+        tables.append(table)
+
+    candidates = []
+    for alias, column in _SQL_CONDITION.findall(stmt):
+        if column.lower() in _SQL_RESERVED:
+            continue
+        if alias:
+            table = aliases.get(alias.lower())
+        else:
+            table = tables[0] if len(tables) == 1 else None
+        if not table:
+            continue
+        # Plans name a scanned table by its alias when it has one
+        if scanned_tables is not None and not {table.lower(), (alias or "").lower()} & scanned_tables:
+            continue
+        candidates.append({"table": table, "column": column, "kind": "filter"})
+    return candidates
+
+def _index_candidates(stmt, plan, dialect):
+    if plan is None:
+        return []
+    if dialect == "postgresql":
+        return _pg_candidates(plan)
+    if dialect == "mysql":
+        return _mysql_candidates(plan)
+    if dialect == "sqlite":
+        # "SCAN orders" / "SCAN TABLE orders" without an index is a full scan
+        scanned = set()
+        for line in plan:
+            words = line.split()
+            if words[:1] == ["SCAN"] and "INDEX" not in line and len(words) > 1:
+                scanned.add((words[2] if words[1] == "TABLE" and len(words) > 2 else words[1]).lower())
+        return _sql_candidates(stmt, scanned)
+    return []
+
+# --- Recording ----------------------------------------------------------------
+
+def _record(stmt, db_path, duration_ms, row_count, params, capture_plan):
+    global _pending
+    try:
+        fp, normalized = fingerprint(stmt)
+        target = mask_uri(db_path)
+        plan, analyzed, dialect, candidates = None, False, None, None
+        if capture_plan:
+            try:
+                plan, analyzed, dialect = _capture_plan(stmt, db_path, params, duration_ms)
+            except Exception as e:
+                print(f"DEBUG: Could not capture plan for slow query: {e}")
+            candidates = _index_candidates(stmt, plan, dialect)
+
+        with _store_lock, _connect() as conn:
+            if candidates is None:
+                # Plan captured recently: reuse its candidates so index
+                # suggestions still weigh this occurrence's time
+                latest = conn.execute(
+                    """SELECT candidates FROM slow_queries WHERE fingerprint = ? AND target = ?
+                       AND plan IS NOT NULL ORDER BY id DESC LIMIT 1""",
+                    (fp, target)
+                ).fetchone()
+                candidates = json.loads(latest["candidates"]) if latest and latest["candidates"] else []
+            cur = conn.execute(
+                """INSERT INTO slow_queries (fingerprint, normalized, sql, target, duration_ms,
+                       row_count, plan, plan_analyzed, candidates, created_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                (fp, normalized, stmt, target, duration_ms, row_count,
+                 json.dumps(plan, default=str) if plan is not None else None,
+                 int(analyzed), json.dumps(candidates), time.time())
+            )
+            # Bounded retention
+            conn.execute("DELETE FROM slow_queries WHERE id <= ?", (cur.lastrowid - SLOW_QUERY_MAX_ENTRIES,))
+    finally:
+        with _pending_lock:
+            _pending -= 1
+
+def _plan_due(stmt: str, db_path: str) -> bool:
+    """
+    True if no plan for this statement's fingerprint and target was captured
+    within SLOW_QUERY_PLAN_INTERVAL; claims the window when it returns True.
+    """
+    key = (fingerprint(stmt)[0], mask_uri(db_path))
+    now = time.time()
+    with _pending_lock:
+        if now - _plan_scheduled.get(key, 0) < SLOW_QUERY_PLAN_INTERVAL:
+            return False
+        if len(_plan_scheduled) > SLOW_QUERY_MAX_ENTRIES:
+            for k in [k for k, ts in _plan_scheduled.items() if now - ts >= SLOW_QUERY_PLAN_INTERVAL]:
+                del _plan_scheduled[k]
+        _plan_scheduled[key] = now
+        return True
+
+def record_if_slow(stmt: str, db_path: str, seconds: float, row_count=None, params: dict = None):
+    """
+    Called by execute_sql_commands for every statement. Cheap when under the
+    threshold; otherwise the occurrence (and, at most once per
+    SLOW_QUERY_PLAN_INTERVAL, its plan) is recorded in the background.
+    """
+    global _pending
+    duration_ms = seconds * 1000
+    if duration_ms < SLOW_QUERY_THRESHOLD_MS:
+        return
+    if not _store_ready:
+        init_slowlog_store()
+    with _pending_lock:
+        if _pending >= SLOW_QUERY_MAX_PENDING:
+            print("DEBUG: Slow query log backlog full, dropping occurrence")
+            return
+        _pending += 1
+    try:
+        _capture_pool.submit(_record, stmt, db_path, duration_ms, row_count, params, _plan_due(stmt, db_path))
+    except Exception as e:
+        # Never fail the query because it couldn't be logged
+        print(f"DEBUG: Could not record slow query: {e}")
+        with _pending_lock:
+            _pending -= 1
+
+# --- Reporting ----------------------------------------------------------------
+
+def top_fingerprints(limit: int = 20, target: str = None):
+    """
+    Slow query fingerprints ordered by total time spent.
+    """
+    if not _store_ready:
+        init_slowlog_store()
+    where, args = ("WHERE target = ?", [mask_uri(target)]) if target else ("", [])
+    with _connect() as conn:
+        rows = conn.execute(
+            f"""SELECT fingerprint, normalized, COUNT(*) AS calls, SUM(duration_ms) AS total_ms,
+                       AVG(duration_ms) AS avg_ms, MAX(duration_ms) AS max_ms,
+                       AVG(row_count) AS avg_rows, MAX(created_at) AS last_seen,
+                       GROUP_CONCAT(DISTINCT target) AS targets
+                FROM slow_queries {where}
+                GROUP BY fingerprint ORDER BY total_ms DESC LIMIT ?""",
+            args + [limit]
+        ).fetchall()
+        result = []
+        for row in rows:
+            latest = conn.execute(
+                f"""SELECT sql, plan, plan_analyzed FROM slow_queries WHERE fingerprint = ?
+                    {"AND target = ?" if target else ""}
+                    ORDER BY plan IS NULL, id DESC LIMIT 1""",
+                [row["fingerprint"]] + args
+            ).fetchone()
+            result.append({
+                "fingerprint": row["fingerprint"],
+                "normalized_sql": row["normalized"],
+                "sample_sql": latest["sql"],
+                "calls": row["calls"],
+                "total_ms": round(row["total_ms"], 2),
+                "avg_ms": round(row["avg_ms"], 2),
+                "max_ms": round(row["max_ms"], 2),
+                "avg_rows": row["avg_rows"],
+                "targets": (row["targets"] or "").split(","),
+                "last_seen": row["last_seen"],
+                "plan": json.loads(latest["plan"]) if latest["plan"] else None,
+                "plan_analyzed": bool(latest["plan_analyzed"]),
+            })
+    return result
+
+def index_suggestions(limit: int = 20, target: str = None):
+    """
+    Heuristic index recommendations: filter and join columns seen on full
+    scans, weighted by the total time of the slow queries they came from.
+    Filter columns of one query on the same table are suggested as one
+    composite index.
+    """
+    if not _store_ready:
+        init_slowlog_store()
+    where, args = ("WHERE target = ?", [mask_uri(target)]) if target else ("", [])
+    with _connect() as conn:
+        rows = conn.execute(
+            f"SELECT fingerprint, target, duration_ms, candidates FROM slow_queries {where}", args
+        ).fetchall()
+
+    suggestions = defaultdict(lambda: {"total_ms": 0.0, "fingerprints": set(), "kinds": set()})
+    for row in rows:
+        by_table = defaultdict(list)
+        for cand in json.loads(row["candidates"] or "[]"):
+            cols = by_table[(cand["table"], cand["kind"])]
+            if cand["column"] not in cols:
+                cols.append(cand["column"])
+        for (table, kind), columns in by_table.items():
+            # Joins probe one column at a time; filters benefit from a composite
+            groups = [columns] if kind == "filter" else [[c] for c in columns]
+            for cols in groups:
+                entry = suggestions[(row["target"], table, tuple(cols[:3]))]
+                entry["total_ms"] += row["duration_ms"]
+                entry["fingerprints"].add(row["fingerprint"])
+                entry["kinds"].add(kind)
+
+    ranked = sorted(suggestions.items(), key=lambda item: item[1]["total_ms"], reverse=True)[:limit]
+    return [
+        {
+            "target": target_name,
+            "table": table,
+            "columns": list(columns),
+            "statement": f"CREATE INDEX idx_{table.replace('.', '_')}_{'_'.join(columns)} ON {table} ({', '.join(columns)})",
+            "reason": " and ".join(sorted(info["kinds"])) + " columns on a full scan",
+            "total_ms": round(info["total_ms"], 2),
+            "queries": len(info["fingerprints"]),
+        }
+        for (target_name, table, columns), info in ranked
+    ]
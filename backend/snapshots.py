@@ -0,0 +1,301 @@
+import os
+import re
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from contextlib import contextmanager
+import sqlparse
+from sqlparse import tokens as T
+
+try:
+    from .agent import execute_sql_commands
+except ImportError:
+    from agent import execute_sql_commands
+
+# Local store for pinned dashboard widgets and their latest result snapshot.
+SNAPSHOT_DB_PATH = os.getenv(
+    "SNAPSHOT_DB_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "snapshots.sqlite")
+)
+SCHEDULER_TICK = int(os.getenv("SNAPSHOT_SCHEDULER_TICK", "15"))  # seconds
+MIN_REFRESH_INTERVAL = 30  # seconds
+MAX_SNAPSHOT_ROWS = int(os.getenv("SNAPSHOT_MAX_ROWS", "10000"))
+# Widgets nobody has read for this many refresh intervals stop refreshing
+# (until read again); after SNAPSHOT_EXPIRE_DAYS unread they are deleted.
+IDLE_INTERVALS = int(os.getenv("SNAPSHOT_IDLE_INTERVALS", "3"))
+EXPIRE_SECONDS = float(os.getenv("SNAPSHOT_EXPIRE_DAYS", "7")) * 86400
+
+_IDENTIFIER = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+_store_lock = threading.Lock()
+
+@contextmanager
+def _connect():
+    conn = sqlite3.connect(SNAPSHOT_DB_PATH, timeout=10)
+    conn.row_factory = sqlite3.Row
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+def init_snapshot_store():
+    with _store_lock, _connect() as conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS widgets (
+                id TEXT PRIMARY KEY,
+                user_email TEXT,
+                connection_uri TEXT,
+                db_target TEXT NOT NULL,
+                sql TEXT NOT NULL,
+                chart_type TEXT,
+                refresh_interval INTEGER NOT NULL,
+                incremental_column TEXT,
+                last_value TEXT,
+                snapshot TEXT,
+                status TEXT DEFAULT 'pending',
+                error_message TEXT,
+                refreshed_at REAL,
+                next_run_at REAL NOT NULL,
+                created_at REAL NOT NULL,
+                last_read_at REAL
+            )
+        """)
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(widgets)")}
+        if "last_read_at" not in columns:
+            # Stores created before read tracking
+            conn.execute("ALTER TABLE widgets ADD COLUMN last_read_at REAL")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_widgets_owner ON widgets (user_email, db_target)")
+
+def _row_to_widget(row, include_data=True):
+    widget = {
+        "id": row["id"],
+        "user_email": row["user_email"],
+        # connection_uri is never returned: it may carry credentials
+        "sql": row["sql"],
+        "chart_type": row["chart_type"],
+        "refresh_interval": row["refresh_interval"],
+        "incremental_column": row["incremental_column"],
+        "status": row["status"],
+        "error_message": row["error_message"],
+        "refreshed_at": row["refreshed_at"],
+        "next_run_at": row["next_run_at"],
+        "last_read_at": row["last_read_at"],
+    }
+    if include_data:
+        widget["data"] = json.loads(row["snapshot"]) if row["snapshot"] else None
+    return widget
+
+def validate_widget_sql(sql):
+    """
+    Returns the widget's single read-only statement, or raises ValueError.
+    Widgets re-run unattended on a schedule, so anything that could modify
+    data (extra statements, data-modifying CTEs, SELECT INTO, FOR UPDATE)
+    is rejected.
+    """
+    statements = [s.strip().rstrip(";").strip() for s in sqlparse.split(sql or "")]
+    statements = [s for s in statements if s]
+    if not statements:
+        raise ValueError("Widget SQL is empty")
+    if len(statements) != 1:
+        raise ValueError("Widgets must be a single SELECT statement")
+
+    statement = sqlparse.parse(statements[0])[0]
+    if statement.get_type() != "SELECT" and not statements[0].upper().startswith("WITH"):
+        raise ValueError("Only SELECT queries can be pinned as widgets")
+    for tok in statement.flatten():
+        if tok.ttype in T.Keyword.DML and tok.normalized != "SELECT":
+            raise ValueError(f"Widget SQL may not contain {tok.normalized}")
+        if tok.ttype in T.Keyword.DDL or (tok.ttype in T.Keyword and tok.normalized == "INTO"):
+            raise ValueError(f"Widget SQL may not contain {tok.normalized}")
+    return statements[0]
+
+def register_widget(sql, db_target, refresh_interval, user_email=None, connection_uri=None,
+                    chart_type="table", incremental_column=None):
+    """
+    Registers a pinned query for background refresh. Raises ValueError for
+    invalid input. The first snapshot is taken on the next scheduler tick.
+    Pinning the same SQL against the same target again returns the existing
+    widget instead of adding another refresh job.
+    """
+    sql = validate_widget_sql(sql)
+    if incremental_column and not _IDENTIFIER.match(incremental_column):
+        raise ValueError(f"Invalid incremental column: {incremental_column}")
+
+    now = time.time()
+    with _store_lock, _connect() as conn:
+        existing = conn.execute(
+            """SELECT id FROM widgets WHERE user_email IS ? AND db_target = ? AND sql = ?
+                   AND incremental_column IS ?""",
+            (user_email, db_target, sql, incremental_column)
+        ).fetchone()
+        if existing:
+            widget_id = existing["id"]
+            conn.execute("UPDATE widgets SET last_read_at = ? WHERE id = ?", (now, widget_id))
+        else:
+            widget_id = str(uuid.uuid4())
+            conn.execute(
+                """INSERT INTO widgets (id, user_email, connection_uri, db_target, sql, chart_type,
+                       refresh_interval, incremental_column, next_run_at, created_at, last_read_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                (widget_id, user_email, connection_uri, db_target, sql, chart_type,
+                 max(int(refresh_interval), MIN_REFRESH_INTERVAL), incremental_column, now, now, now)
+            )
+    return get_widget(widget_id)
+
+def get_widget(widget_id, touch=False):
+    """
+    Returns a widget with its snapshot. `touch` marks it as read, which keeps
+    it on the refresh schedule; internal lookups leave it alone.
+    """
+    with _connect() as conn:
+        if touch:
+            conn.execute("UPDATE widgets SET last_read_at = ? WHERE id = ?", (time.time(), widget_id))
+        row = conn.execute("SELECT * FROM widgets WHERE id = ?", (widget_id,)).fetchone()
+    return _row_to_widget(row) if row else None
+
+def list_widgets(user_email=None, connection_uri=None, include_data=True, touch=False):
+    with _connect() as conn:
+        query = "WHERE user_email IS ? AND COALESCE(connection_uri, '') = ?"
+        args = (user_email, connection_uri or "")
+        if touch:
+            conn.execute(f"UPDATE widgets SET last_read_at = ? {query}", (time.time(),) + args)
+        rows = conn.execute(f"SELECT * FROM widgets {query} ORDER BY created_at", args).fetchall()
+    return [_row_to_widget(r, include_data) for r in rows]
+
+def delete_widget(widget_id):
+    with _store_lock, _connect() as conn:
+        cur = conn.execute("DELETE FROM widgets WHERE id = ?", (widget_id,))
+    return cur.rowcount > 0
+
+def _claim_due_widgets(now):
+    """
+    Pushes next_run_at forward for every due widget that is still being read
+    and returns them. The conditional UPDATE acts as a lease, so several
+    workers sharing the store never refresh the same widget twice.
+    Widgets unread for EXPIRE_SECONDS are deleted.
+    """
+    claimed = []
+    with _store_lock, _connect() as conn:
+        cur = conn.execute(
+            "DELETE FROM widgets WHERE COALESCE(last_read_at, created_at) < ?", (now - EXPIRE_SECONDS,)
+        )
+        if cur.rowcount:
+            print(f"INFO: Expired {cur.rowcount} unread dashboard widget(s)")
+        # Idle widgets stay due, so they refresh on the first tick after a read
+        rows = conn.execute(
+            """SELECT * FROM widgets WHERE next_run_at <= ?
+                   AND COALESCE(last_read_at, created_at) >= ? - refresh_interval * ?""",
+            (now, now, IDLE_INTERVALS)
+        ).fetchall()
+        for row in rows:
+            cur = conn.execute(
+                "UPDATE widgets SET next_run_at = ? WHERE id = ? AND next_run_at = ?",
+                (now + row["refresh_interval"], row["id"], row["next_run_at"])
+            )
+            if cur.rowcount:
+                claimed.append(row)
+    return claimed
+
+def refresh_widget(widget_id):
+    """
+    Executes the widget's SQL through execute_sql_commands and stores the result.
+    Append-only widgets (incremental_column set) only fetch rows past the
+    last seen value and append them to the existing snapshot.
+    """
+    with _connect() as conn:
+        row = conn.execute("SELECT * FROM widgets WHERE id = ?", (widget_id,)).fetchone()
+    if not row:
+        return None
+
+    try:
+        # Widgets stored before validation was tightened are checked again here
+        validate_widget_sql(row["sql"])
+    except ValueError as e:
+        with _store_lock, _connect() as conn:
+            conn.execute(
+                "UPDATE widgets SET status = 'error', error_message = ? WHERE id = ?",
+                (str(e), widget_id)
+            )
+        return get_widget(widget_id)
+
+    previous = json.loads(row["snapshot"]) if row["snapshot"] else None
+    column = row["incremental_column"]
+    last_value = json.loads(row["last_value"]) if row["last_value"] else None
+    incremental = bool(column and previous is not None and last_value is not None)
+
+    if incremental:
+        sql = f'SELECT * FROM ({row["sql"]}) AS _widget_src WHERE {column} > :last_value'
+        datasets = execute_sql_commands(sql, row["db_target"], params={"last_value": last_value})
+    else:
+        datasets = execute_sql_commands(row["sql"], row["db_target"])
+
+    result = datasets[-1] if datasets else {"type": "error", "data": [{"error": "No result"}]}
+    now = time.time()
+
+    if result.get("type") == "error":
+        error_msg = result.get("data", [{}])[0].get("error", "Unknown Error")
+        with _store_lock, _connect() as conn:
+            # Keep serving the previous snapshot
+            conn.execute(
+                "UPDATE widgets SET status = 'error', error_message = ? WHERE id = ?",
+                (error_msg, widget_id)
+            )
+        return get_widget(widget_id)
+
+    # Normalise to JSON types so old and new rows compare consistently
+    fresh = json.loads(json.dumps(result.get("data") or [], default=str))
+    if incremental:
+        data = (previous + fresh)[-MAX_SNAPSHOT_ROWS:]
+    else:
+        data = fresh[:MAX_SNAPSHOT_ROWS]
+
+    new_last_value = last_value
+    if column:
+        values = [r[column] for r in fresh if r.get(column) is not None]
+        if values:
+            new_last_value = max(values) if new_last_value is None else max(new_last_value, *values)
+
+    with _store_lock, _connect() as conn:
+        conn.execute(
+            """UPDATE widgets SET snapshot = ?, last_value = ?, status = 'fresh',
+                   error_message = NULL, refreshed_at = ? WHERE id = ?""",
+            (json.dumps(data),
+             json.dumps(new_last_value) if new_last_value is not None else None,
+             now, widget_id)
+        )
+    return get_widget(widget_id)
+
+class SnapshotScheduler:
+    """
+    Background thread that refreshes due widgets every SCHEDULER_TICK seconds.
+    """
+    def __init__(self, tick=SCHEDULER_TICK):
+        self.tick = tick
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="snapshot-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                for row in _claim_due_widgets(time.time()):
+                    try:
+                        refresh_widget(row["id"])
+                    except Exception as e:
+                        print(f"ERROR: Widget refresh failed for {row['id']}: {e}")
+            except Exception as e:
+                print(f"ERROR: Snapshot scheduler tick failed: {e}")
+            self._stop.wait(self.tick)
+
+scheduler = SnapshotScheduler()
@@ -13,7 +13,8 @@ export const ConnectionManager = ({ isOpen, onClose, onConnectionChanged }) => {
         port: '5432',
         database: 'postgres',
         username: 'postgres',
-        password: ''
+        password: '',
+        replicaHosts: '' // Optional read replicas, e.g. "replica1:5432,replica2:5432"
     });
 
     const [showPassword, setShowPassword] = useState(false);
@@ -39,12 +40,15 @@ export const ConnectionManager = ({ isOpen, onClose, onConnectionChanged }) => {
         const userEncoded = encodeURIComponent(config.username);
         const passEncoded = encodeURIComponent(config.password);
         const dbEncoded = encodeURIComponent(config.database);
+        // Read-only queries are routed to these hosts by the backend
+        const replicas = (config.replicaHosts || '').trim();
+        const query = replicas ? `?replica_hosts=${encodeURIComponent(replicas)}` : '';
 
         if (config.type === 'postgres') {
-            return `postgresql://${userEncoded}:${passEncoded}@${config.host}:${config.port}/${dbEncoded}`;
+            return `postgresql://${userEncoded}:${passEncoded}@${config.host}:${config.port}/${dbEncoded}${query}`;
         }
         if (config.type === 'mysql') {
-            return `mysql+pymysql://${userEncoded}:${passEncoded}@${config.host}:${config.port}/${dbEncoded}`;
+            return `mysql+pymysql://${userEncoded}:${passEncoded}@${config.host}:${config.port}/${dbEncoded}${query}`;
         }
         return '';
     };
@@ -270,6 +274,15 @@ export const ConnectionManager = ({ isOpen, onClose, onConnectionChanged }) => {
                                         icon={Database}
                                     />
 
+                                    <InputField
+                                        label="Read Replicas (optional)"
+                                        name="replicaHosts"
+                                        value={config.replicaHosts || ''}
+                                        onChange={handleChange}
+                                        placeholder="replica1:5432,replica2:5432"
+                                        icon={Globe}
+                                    />
+
                                     <div className="grid grid-cols-2 gap-4">
                                         <InputField
                                             label="Username"
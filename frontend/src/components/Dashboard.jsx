@@ -11,15 +11,16 @@ export const Dashboard = () => {
     const [widgets, setWidgets] = useState([]);
     const [loading, setLoading] = useState({});
 
-    // Load widgets from localStorage on mount
+    // Load widgets from localStorage on mount (data comes from server snapshots when registered)
     useEffect(() => {
         const saved = localStorage.getItem('pinned_widgets');
         if (saved) {
             try {
                 const parsed = JSON.parse(saved);
                 setWidgets(parsed);
-                // Refresh data for all widgets silently
-                parsed.forEach(w => refreshWidgetData(w, true));
+                // Load snapshots silently; widgets pinned before server-side
+                // snapshots existed are registered once instead of queried live
+                parsed.forEach(w => (w.serverId ? refreshWidgetData(w, true) : migrateWidget(w)));
             } catch (e) {
                 console.error("Failed to parse pinned widgets", e);
             }
@@ -44,8 +45,47 @@ export const Dashboard = () => {
         return widgetUri === currentUri;
     });
 
+    const persistServerId = (widgetId, serverId) => {
+        const saved = localStorage.getItem('pinned_widgets');
+        const stored = saved ? JSON.parse(saved) : [];
+        localStorage.setItem('pinned_widgets', JSON.stringify(
+            stored.map(w => (w.id === widgetId ? { ...w, serverId } : w))
+        ));
+        setWidgets(prev => prev.map(w => (w.id === widgetId ? { ...w, serverId } : w)));
+    };
+
+    // Registers a locally pinned widget server-side and takes its first snapshot
+    const migrateWidget = async (widget) => {
+        if (!widget.sql) return;
+        try {
+            const userInfo = localStorage.getItem('user_info');
+            const userEmail = userInfo ? JSON.parse(userInfo).email : null;
+            const res = await axios.post(`${API_BASE_URL}/widgets`, {
+                sql: widget.sql,
+                user_email: userEmail,
+                connection_uri: widget.connectionUri,
+                chart_type: widget.chartType
+            });
+            const serverId = res.data.widget?.id;
+            persistServerId(widget.id, serverId);
+            return loadSnapshot({ ...widget, serverId }, true, true);
+        } catch (error) {
+            if (error.response?.status === 400) {
+                // Rejected (e.g. not a single SELECT): never run it automatically
+                const errorMsg = error.response.data?.detail || 'Widget query is not allowed';
+                setWidgets(prev => prev.map(w =>
+                    w.id === widget.id ? { ...w, error: errorMsg, data: null } : w
+                ));
+                return;
+            }
+            console.error(`Failed to register widget ${widget.id}, falling back to a live query`, error);
+            return refreshWidgetData(widget, true);
+        }
+    };
+
     const refreshWidgetData = async (widget, silent = false) => {
         if (!widget.sql) return;
+        if (widget.serverId) return loadSnapshot(widget, silent);
 
         setLoading(prev => ({ ...prev, [widget.id]: true }));
         try {
@@ -80,7 +120,47 @@ export const Dashboard = () => {
         }
     };
 
+    // Server-side widgets: silent loads read the stored snapshot, manual refresh re-runs the query
+    const loadSnapshot = async (widget, silent = false, rerun = !silent) => {
+        setLoading(prev => ({ ...prev, [widget.id]: true }));
+        try {
+            const response = !rerun
+                ? await axios.get(`${API_BASE_URL}/widgets/${widget.serverId}`)
+                : await axios.post(`${API_BASE_URL}/widgets/${widget.serverId}/refresh`);
+            const snapshot = response.data.widget;
+            setWidgets(prev => prev.map(w =>
+                w.id === widget.id
+                    ? {
+                        ...w,
+                        data: snapshot.data,
+                        error: snapshot.data ? null : snapshot.error_message,
+                        lastUpdated: snapshot.refreshed_at ? new Date(snapshot.refreshed_at * 1000).toISOString() : null
+                    }
+                    : w
+            ));
+            if (!silent) toast.success('Widget data refreshed');
+        } catch (error) {
+            if (error.response?.status === 404) {
+                // Snapshot no longer registered (e.g. store was reset), register it again
+                return migrateWidget(widget);
+            }
+            console.error(`Failed to load snapshot for widget ${widget.id}`, error);
+            setWidgets(prev => prev.map(w =>
+                w.id === widget.id ? { ...w, error: error.message || 'Failed to load snapshot' } : w
+            ));
+            if (!silent) toast.error('Failed to refresh widget data');
+        } finally {
+            setLoading(prev => ({ ...prev, [widget.id]: false }));
+        }
+    };
+
     const removeWidget = (id) => {
+        const widget = widgets.find(w => w.id === id);
+        if (widget?.serverId) {
+            axios.delete(`${API_BASE_URL}/widgets/${widget.serverId}`).catch(err =>
+                console.error("Failed to unregister widget", err)
+            );
+        }
         const updated = widgets.filter(w => w.id !== id);
         setWidgets(updated);
         localStorage.setItem('pinned_widgets', JSON.stringify(updated));
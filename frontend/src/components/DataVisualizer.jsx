@@ -12,6 +12,8 @@ import { motion, AnimatePresence } from 'framer-motion';
 import { useTheme } from './ThemeContext';
 import { toPng } from 'html-to-image';
 import jsPDF from 'jspdf';
+import axios from 'axios';
+import { API_BASE_URL } from '../config';
 
 export const DataVisualizer = ({ data, type = 'table', sql, initialConfig, connectionUri }) => {
     const { theme } = useTheme();
@@ -56,7 +58,7 @@ export const DataVisualizer = ({ data, type = 'table', sql, initialConfig, conne
         }
     }, [data, viewMode]);
 
-    const handlePin = () => {
+    const handlePin = async () => {
         if (!sql) return;
         const newWidget = {
             id: Date.now(),
@@ -67,6 +69,21 @@ export const DataVisualizer = ({ data, type = 'table', sql, initialConfig, conne
             timestamp: new Date().toISOString()
         };
 
+        // Register server-side so the dashboard reads a background-refreshed snapshot
+        try {
+            const userInfo = localStorage.getItem('user_info');
+            const userEmail = userInfo ? JSON.parse(userInfo).email : null;
+            const res = await axios.post(`${API_BASE_URL}/widgets`, {
+                sql: sql,
+                user_email: userEmail,
+                connection_uri: connectionUri,
+                chart_type: viewMode
+            });
+            newWidget.serverId = res.data.widget?.id;
+        } catch (err) {
+            console.error("Failed to register widget, falling back to live queries", err);
+        }
+
         const saved = localStorage.getItem('pinned_widgets');
         const widgets = saved ? JSON.parse(saved) : [];
         widgets.push(newWidget);
@@ -11,7 +11,8 @@ export const HealthDashboard = ({ user, connectionUri }) => {
     const [error, setError] = useState(null);
     const [lastUpdated, setLastUpdated] = useState(null);
 
-    const fetchHealth = async () => {
+    // Polls reuse the server's cached database probe; the Refresh button forces a new one
+    const fetchHealth = async (refresh = false) => {
         setLoading(true);
         try {
             const startTime = performance.now();
@@ -19,6 +20,7 @@ export const HealthDashboard = ({ user, connectionUri }) => {
             const params = {};
             if (user?.email) params.user_email = user.email;
             if (connectionUri) params.connection_uri = connectionUri;
+            if (refresh) params.refresh = true;
 
             const res = await axios.get(`${API_BASE_URL}/health`, { params });
             const endTime = performance.now();
@@ -39,7 +41,7 @@ export const HealthDashboard = ({ user, connectionUri }) => {
 
     useEffect(() => {
         fetchHealth();
-        const interval = setInterval(fetchHealth, 30000); // Poll every 30s
+        const interval = setInterval(() => fetchHealth(), 30000); // Poll every 30s
         return () => clearInterval(interval);
     }, [user, connectionUri]); // Re-fetch if props change
 
@@ -64,7 +66,7 @@ export const HealthDashboard = ({ user, connectionUri }) => {
                         <p className="text-zinc-500 mt-2">Real-time metrics and status of the SQL Agent infrastructure.</p>
                     </div>
                     <button
-                        onClick={fetchHealth}
+                        onClick={() => fetchHealth(true)}
                         className="px-4 py-2 bg-white dark:bg-zinc-800 border border-zinc-200 dark:border-zinc-700 rounded-lg shadow-sm hover:bg-zinc-50 dark:hover:bg-zinc-700 transition-colors flex items-center gap-2 text-sm font-medium"
                     >
                         <Clock size={16} />
@@ -142,6 +144,10 @@ export const HealthDashboard = ({ user, connectionUri }) => {
                                 </h3>
                                 <div className="space-y-4">
                                     <InfoRow label="Status Message" value={stats?.message} />
+                                    <InfoRow label="Pool In Use" value={stats?.pool?.checkedout !== undefined ? `${stats.pool.checkedout} / ${stats.pool.size ?? '-'}` : 'N/A'} />
+                                    <InfoRow label="Checkout Latency" value={stats?.checkout_latency_ms !== undefined ? `${stats.checkout_latency_ms}ms` : 'N/A'} />
+                                    <InfoRow label="Query p50 / p95" value={stats?.query_latency?.count ? `${Math.round(stats.query_latency.p50_ms)}ms / ${Math.round(stats.query_latency.p95_ms)}ms` : 'No queries yet'} />
+                                    <InfoRow label="AI Model" value={stats?.llm ? `${stats.llm.model} (${stats.llm.available === false ? 'Unavailable' : 'Available'})` : 'N/A'} />
                                     <InfoRow label="Host" value="localhost" />
                                     <InfoRow label="Port" value="8000" />
                                     <InfoRow label="Environment" value="Development" />